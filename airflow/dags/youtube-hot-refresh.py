@@ -0,0 +1,83 @@
+from airflow.decorators import dag, task
+from airflow.sdk import Param
+from datetime import datetime, timedelta
+from include.cloud_functions import call_function
+
+# Same pools as the daily pipeline so both DAGs share the quota limits
+EXTRACT_POOL = "youtube_api"
+BIGQUERY_POOL = "bigquery"
+TRANSFORM_POOL = "bigquery_dml"  # 1 slot: MERGEs into fact_video_statistics never overlap
+
+# ----------------------------------------------------------------
+# DAG definition
+# ----------------------------------------------------------------
+# Lightweight intraday refresh: statistics only (videos.list, 1 unit per
+# 50 IDs) for recently published or fast-growing videos, merged into
+# today's row of fact_video_statistics.
+@dag(
+    schedule="@hourly",
+    start_date=datetime(2025, 1, 1),
+    catchup=False,
+    max_active_runs=1,
+    default_args={
+        "retries": 2,
+        "retry_delay": timedelta(minutes=1),
+        "execution_timeout": timedelta(minutes=10),
+    },
+    params={
+        "max_videos": Param(500, type="integer", minimum=1, description="Size of the hot set"),
+        "recent_hours": Param(48, type="integer", minimum=1, description="Videos published within this many hours are hot"),
+        "ingest_mode": Param("fused", enum=["staged", "fused"], description="fused: raw-extract loads the stats rows itself; staged: via GCS and raw-parse"),
+    },
+    tags=["youtube", "pipeline", "intraday"]
+)
+def youtube_hot_refresh():
+
+    # STEP 0 - Apply the raw schema first: fused refreshes load the raw tables directly
+    @task.branch
+    def check_schema():
+        resp = call_function("raw-schema", data={"check_only": True})
+        print("Schema Check:", resp)
+        if resp.get("up_to_date"):
+            return None  # skip `schema`; refresh_stats still runs (trigger rule none_failed)
+        return "schema"
+
+    @task
+    def schema():
+        resp = call_function("raw-schema")
+        print("Schema Response:", resp)
+        return resp
+
+    # STEP 1 - Refresh statistics for the hot set
+    @task(trigger_rule="none_failed", pool=EXTRACT_POOL)
+    def refresh_stats(params=None):
+        resp = call_function("raw-extract", data={
+            "mode": "hot_stats",
+            "max_videos": params["max_videos"],
+            "recent_hours": params["recent_hours"],
+            "ingest_mode": params["ingest_mode"],
+        })
+        print("Refresh Response:", resp)
+        return resp
+
+    # STEP 2 - Load the stats rows to BigQuery (already done by raw-extract in fused mode)
+    @task(pool=BIGQUERY_POOL)
+    def load(payload: dict):
+        if "loaded" in payload:
+            return {**payload, "skipped": True}
+        resp = call_function("raw-parse", data=payload)
+        print("Load Response:", resp)
+        return resp
+
+    # STEP 3 - Merge only the statistics fact
+    @task(pool=TRANSFORM_POOL)
+    def transform(load_result: dict):
+        resp = call_function("raw-transform", data={"tables": ["fact_video_statistics"]})
+        print("Transform Response:", resp)
+        return resp
+
+    stats = refresh_stats()
+    check_schema() >> schema() >> stats
+    transform(load(stats))
+
+youtube_hot_refresh()
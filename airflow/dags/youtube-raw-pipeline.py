@@ -1,18 +1,31 @@
 from airflow.decorators import dag, task
-from datetime import datetime
+from airflow.sdk import Param, PokeReturnValue
+from datetime import datetime, timedelta
 from airflow.operators.python import get_current_context
-import requests
+from include.cloud_functions import call_function
 
-# ----------------------------------------------------------------
-# Helper function to call your deployed Cloud Functions
-# ----------------------------------------------------------------
-def invoke_function(url, data=None):
-    """
-    Invoke our cloud function via POST with JSON payload.
-    """
-    resp = requests.post(url, json=data or {})
-    resp.raise_for_status()
-    return resp.json()
+# Queries tracked by default; override per run with the `queries` param
+DEFAULT_QUERIES = ["NFL"]
+
+# Airflow pools (create them in the UI or airflow_settings.yaml):
+# - youtube_api bounds concurrent extract calls; each one spends YouTube API quota
+# - bigquery bounds concurrent load/transform calls across runs, e.g. during a backfill
+# - bigquery_dml (1 slot) serializes the transform MERGEs: they all write the same
+#   youtube_staging tables, and BigQuery aborts concurrent DML on one table
+EXTRACT_POOL = "youtube_api"
+BIGQUERY_POOL = "bigquery"
+TRANSFORM_POOL = "bigquery_dml"
+
+# Runs for different dates may proceed in parallel; the pools keep them within quota
+MAX_ACTIVE_RUNS = 8
+
+# How often / how long to wait on BigQuery jobs submitted in async mode.
+# Reschedule mode releases the worker slot between pokes.
+JOB_POKE_INTERVAL = 30
+JOB_WAIT_TIMEOUT = 6 * 60 * 60
+
+# One search.list page; larger `max_videos` switch raw-extract to chunked windows
+SEARCH_PAGE_SIZE = 50
 
 # ----------------------------------------------------------------
 # DAG definition
@@ -21,53 +34,181 @@ def invoke_function(url, data=None):
     schedule="@daily",   # Runs once a day at midnight UTC
     start_date=datetime(2025, 1, 1),
     catchup=False,
+    max_active_runs=MAX_ACTIVE_RUNS,
+    default_args={
+        "retries": 2,
+        "retry_delay": timedelta(minutes=2),
+        "retry_exponential_backoff": True,
+        "execution_timeout": timedelta(minutes=15),
+    },
+    params={
+        "queries": Param(DEFAULT_QUERIES, type="array", description="Search queries to extract"),
+        "max_videos": Param(SEARCH_PAGE_SIZE, type="integer", minimum=1, description="Videos to extract per query"),
+        "async_jobs": Param(True, type="boolean", description="Submit BigQuery load jobs and wait with a sensor (transform always waits in its pool slot)"),
+        "tracked_shards": Param(8, type="integer", minimum=0, description="Parallel shards for the tracked-video stats refresh (0 disables it; skipped when refresh_budget_units is set)"),
+        "refresh_budget_units": Param(0, type="integer", minimum=0, description="API units for the priority-scheduled refresh (0 disables it; replaces the tracked shards)"),
+        "ingest_mode": Param("staged", enum=["staged", "fused"], description="staged: raw-extract writes to GCS and load runs raw-parse; fused: raw-extract loads the raw tables itself and archives the file"),
+        "raw_source": Param("native", enum=["native", "external"], description="native: load raw files into youtube_raw tables; external: transform reads the GCS files through the ext_* tables (no load)"),
+        "backfill": Param(False, type="boolean", description="Reprocess already-extracted raw files for the logical date"),
+    },
     tags=["youtube", "pipeline"]
 )
 def youtube_pipeline():
-    
-    # STEP 1 - Create schema (BigQuery table)
+
+    # STEP 1a - Skip schema setup when the deployed version is already applied
+    @task.branch
+    def check_schema():
+        resp = call_function("raw-schema", data={"check_only": True})
+        print("Schema Check:", resp)
+        if resp.get("up_to_date"):
+            return None  # skip `schema`; downstream tasks still run (trigger rule none_failed)
+        return "schema"
+
+    # STEP 1b - Create schema (BigQuery table)
     @task
     def schema():
-        url = "https://us-central1-adrineto-qst882-fall25.cloudfunctions.net/raw-schema"
-        resp = invoke_function(url)
+        resp = call_function("raw-schema")
         print("Schema Response:", resp)
         return resp
 
-    # STEP 2 - Extract data from YouTube API
+    # STEP 2 - Resolve the list of queries for this run
     @task
-    def extract(payload: dict):
-        url = "https://us-central1-adrineto-qst882-fall25.cloudfunctions.net/raw-extract"
+    def get_queries():
         ctx = get_current_context()
-        payload['run_id'] = ctx["dag_run"].run_id
-        payload['date'] = ctx["ds_nodash"]
-        resp = invoke_function(url, data=payload)
+        queries = [q.strip() for q in ctx["params"]["queries"] if q and q.strip()]
+        # dedupe while keeping order so the same query isn't extracted twice
+        queries = list(dict.fromkeys(queries))
+        print("Queries:", queries)
+        return queries
+
+    # STEP 3 - Extract data from YouTube API (one mapped task per query)
+    # none_failed: check_schema may skip `schema`
+    @task(trigger_rule="none_failed", pool=EXTRACT_POOL)
+    def extract(query: str):
+        ctx = get_current_context()
+        if ctx["params"]["backfill"]:
+            # Backfills reuse the raw files already in GCS; don't re-spend API quota
+            return {"query": query, "backfill": True}
+        payload = {
+            "query": query,
+            "run_id": ctx["dag_run"].run_id,
+            "date": ctx["ds_nodash"],
+        }
+        if ctx["params"]["raw_source"] == "external":
+            payload["layout"] = "entity"
+        payload["ingest_mode"] = ctx["params"]["ingest_mode"]
+        max_videos = ctx["params"]["max_videos"]
+        if max_videos > SEARCH_PAGE_SIZE:
+            # Page through the results in bounded windows, one part file each
+            payload.update({"chunked": True, "max_videos": max_videos})
+        resp = call_function("raw-extract", data=payload)
         print("Extract Response:", resp)
         return resp
 
-    # STEP 3 - Load data to BigQuery
+    # STEP 3b - Refresh statistics for the tracked-video registry, one mapped task per shard
     @task
+    def get_shards():
+        ctx = get_current_context()
+        if ctx["params"]["refresh_budget_units"]:
+            # The priority refresh (STEP 3c) already covers the tracked registry;
+            # refreshing it in shards too would spend the quota twice
+            print("refresh_budget_units is set; skipping the tracked shards")
+            return []
+        return list(range(ctx["params"]["tracked_shards"]))
+
+    @task(trigger_rule="none_failed", pool=EXTRACT_POOL)
+    def refresh_tracked(shard: int):
+        ctx = get_current_context()
+        num_shards = ctx["params"]["tracked_shards"]
+        if ctx["params"]["backfill"]:
+            # Same label raw-extract uses, so the backfill reloads this shard's files
+            return {"query": f"tracked-{shard}-of-{num_shards}", "backfill": True}
+        payload = {"mode": "tracked_stats", "shard": shard, "num_shards": num_shards}
+        if ctx["params"]["raw_source"] == "external":
+            payload["layout"] = "entity"
+        payload["ingest_mode"] = ctx["params"]["ingest_mode"]
+        resp = call_function("raw-extract", data=payload)
+        print("Tracked Refresh Response:", resp)
+        return resp
+
+    # STEP 3c - Spend a unit budget on the highest-value refreshes (see raw-extract/scheduler.py)
+    @task(trigger_rule="none_failed", pool=EXTRACT_POOL)
+    def scheduled_refresh():
+        ctx = get_current_context()
+        budget = ctx["params"]["refresh_budget_units"]
+        if not budget:
+            return []
+        if ctx["params"]["backfill"]:
+            return [{"query": "scheduled", "backfill": True}]
+        payload = {"mode": "scheduled", "budget_units": budget}
+        if ctx["params"]["raw_source"] == "external":
+            payload["layout"] = "entity"
+        payload["ingest_mode"] = ctx["params"]["ingest_mode"]
+        resp = call_function("raw-extract", data=payload)
+        print("Scheduled Refresh Response:", resp)
+        return [resp]
+
+    # STEP 4 - Load data to BigQuery (one mapped task per extract)
+    @task(trigger_rule="none_failed", pool=BIGQUERY_POOL)
     def load(payload: dict):
-        url = "https://us-central1-adrineto-qst882-fall25.cloudfunctions.net/raw-parse"
         ctx = get_current_context()
+        if ctx["params"]["raw_source"] == "external":
+            # The external tables already see the new files; nothing to load
+            return {**payload, "skipped": True}
+        if "loaded" in payload:
+            # Fused mode: raw-extract already loaded these rows. Backfills and
+            # chunked extracts still go through raw-parse.
+            return {**payload, "skipped": True}
         payload['date'] = ctx["ds_nodash"]
-        resp = invoke_function(url, data=payload)
+        payload['async'] = ctx["params"]["async_jobs"]
+        resp = call_function("raw-parse", data=payload)
         print("Load Response:", resp)
         return resp
 
-    # STEP 4 - Transform data to BigQuery
-    @task
-    def transform(payload: dict):
-        url = "https://us-central1-adrineto-qst882-fall25.cloudfunctions.net/raw-transform"
+    # Wait for BigQuery jobs returned by an async call, without holding a worker slot
+    @task.sensor(poke_interval=JOB_POKE_INTERVAL, timeout=JOB_WAIT_TIMEOUT, mode="reschedule")
+    def wait_for_jobs(function: str, result: dict):
+        if not result.get("jobs"):
+            # Sync mode (or nothing to load): the work is already done
+            return PokeReturnValue(is_done=True, xcom_value=result)
+        # index_file: raw-parse's staged ingest index, loaded once the data loads succeed
+        status = call_function(function, data={"jobs": result["jobs"], "index_file": result.get("index_file")})
+        print("Job status:", status)
+        if status["status"] == "failed":
+            raise RuntimeError(f"BigQuery job failed: {status['jobs']}")
+        return PokeReturnValue(is_done=status["status"] == "done", xcom_value=result)
+
+    # STEP 5 - Transform data to BigQuery (fan-in: runs once for all queries)
+    # Synchronous even with async_jobs: the pool slot must be held until the
+    # MERGEs commit, or parallel backfill runs would overlap their DML
+    @task(pool=TRANSFORM_POOL)
+    def transform(load_results: list):
+        # load_results only orders transform after every load; the MERGEs are
+        # scoped by the logical date
         ctx = get_current_context()
-        payload['date'] = ctx["ds_nodash"]
-        resp = invoke_function(url, data=payload)
-        print("Load Response:", resp)
+        payload = {
+            "date": ctx["ds_nodash"],
+            "async": False,
+            "source": ctx["params"]["raw_source"],
+        }
+        resp = call_function("raw-transform", data=payload)
+        print("Transform Response:", resp)
         return resp
 
-    # Define task dependencies (schema → extract → load)
-    schema_result = schema()
-    extract_result = extract(schema_result)
-    load_result = load(extract_result)
-    transform_result = transform(load_result)
+    # Define task dependencies
+    #                          ┌→ extract[query...]         ┐
+    # check_schema → [schema] ─┼→ refresh_tracked[shard...] ┼→ load[...] → wait → transform
+    #                          └→ scheduled_refresh         ┘
+    # Extract waits for the schema: in fused mode it loads the raw tables itself.
+    schema_result = check_schema() >> schema()
+    queries = get_queries()
+    extract_results = extract.expand(query=queries)
+    tracked_results = refresh_tracked.expand(shard=get_shards())
+    scheduled_results = scheduled_refresh()
+    load_results = load.expand(payload=extract_results.concat(tracked_results, scheduled_results))
+    loaded = wait_for_jobs.override(task_id="wait_for_load").partial(function="raw-parse").expand(result=load_results)
+    transform(loaded)
+
+    schema_result >> [extract_results, tracked_results, scheduled_results]
 
-youtube_pipeline()
\ No newline at end of file
+youtube_pipeline()
@@ -0,0 +1,134 @@
+"""
+Shared HTTP invoker for our Cloud Functions.
+
+One pooled requests.Session per worker process, so keep-alive connections
+(and the ID token, when auth is enabled) are reused across calls.
+"""
+import logging
+import os
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+BASE_URL = "https://us-central1-adrineto-qst882-fall25.cloudfunctions.net"
+
+# (connect, read) seconds. The functions are deployed with a 900 s timeout
+# (bash-deploy.sh), matching the DAGs' 15-minute execution_timeout; the read
+# timeout just has to outlast both
+DEFAULT_TIMEOUT = (10, 15 * 60)
+
+# Transport-level retries only where the function did no work: failed
+# connects and 429 (rejected before running). A 5xx may come after the work
+# committed (loads, API quota), so those are left to Airflow's task retries.
+RETRY_STATUSES = (429,)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 2
+
+# Set CLOUD_FUNCTIONS_AUTH=true once the functions are no longer public
+USE_ID_TOKEN = os.getenv("CLOUD_FUNCTIONS_AUTH", "false").lower() == "true"
+
+# Global session and token cache (lazy, per worker process)
+_session = None
+_id_tokens = {}
+
+
+def get_session():
+    """
+    Lazy initialization of the pooled HTTP session.
+    """
+    global _session
+
+    if _session is None:
+        retry = Retry(
+            total=MAX_RETRIES,
+            connect=MAX_RETRIES,
+            read=0,  # don't re-send a request the function may still be running
+            status=MAX_RETRIES,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,  # include POST; only RETRY_STATUSES are retried
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        _session = requests.Session()
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+
+    return _session
+
+
+def _get_id_token(audience):
+    """
+    Fetch (and cache until shortly before expiry) an ID token for a function URL.
+    """
+    token, expires_at = _id_tokens.get(audience, (None, 0))
+    if token and time.time() < expires_at:
+        return token
+
+    import google.auth.transport.requests
+    import google.oauth2.id_token
+
+    token = google.oauth2.id_token.fetch_id_token(
+        google.auth.transport.requests.Request(), audience
+    )
+    # Google ID tokens live for one hour; refresh a few minutes early
+    _id_tokens[audience] = (token, time.time() + 55 * 60)
+    return token
+
+
+def idempotency_key(*parts):
+    """
+    Build a deterministic key so Airflow retries of the same task reuse it.
+    """
+    parts = [str(p) for p in parts if p is not None]
+    if not parts:
+        return uuid.uuid4().hex
+    return uuid.uuid5(uuid.NAMESPACE_URL, "/".join(parts)).hex
+
+
+def invoke_function(name, data=None, key=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Invoke a cloud function by name (e.g. "raw-extract") via POST with JSON payload.
+    Logs latency, response size and retry count for every call.
+    """
+    url = name if name.startswith("http") else f"{BASE_URL}/{name}"
+    headers = {"Idempotency-Key": key or idempotency_key()}
+    if USE_ID_TOKEN:
+        headers["Authorization"] = f"Bearer {_get_id_token(url)}"
+
+    start = time.monotonic()
+    resp = get_session().post(url, json=data or {}, headers=headers, timeout=timeout)
+    elapsed = time.monotonic() - start
+
+    retries = len(resp.raw.retries.history) if getattr(resp.raw, "retries", None) else 0
+    log.info(
+        "invoke %s status=%s latency=%.2fs bytes=%d retries=%d key=%s",
+        name, resp.status_code, elapsed, len(resp.content), retries, headers["Idempotency-Key"],
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def call_function(name, data=None):
+    """
+    Invoke a cloud function from inside an Airflow task, keyed on the task
+    instance so retries of the same task send the same idempotency key.
+    Every call carries the run_id, logical date and retry count so the
+    functions can trace all stages of a run together.
+    """
+    from airflow.operators.python import get_current_context
+
+    ctx = get_current_context()
+    ti = ctx["ti"]
+    key = idempotency_key(ti.dag_id, ti.run_id, ti.task_id, ti.map_index)
+    data = dict(data or {})
+    data.setdefault("run_id", ti.run_id)
+    data.setdefault("date", ctx["ds_nodash"])
+    data["try_number"] = max(ti.try_number - 1, 0)
+    return invoke_function(name, data=data, key=key)
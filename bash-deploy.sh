@@ -20,6 +20,8 @@ REGION="us-central1"
 RUNTIME="python312"
 SERVICE_ACCOUNT="class3demosa@adrineto-qst882-fall25.iam.gserviceaccount.com"
 STAGE_BUCKET="adrineto-ba882-fall25-functions"
+# Matches the DAGs' 15-minute execution_timeout (the default is only 60s)
+TIMEOUT="900s"
 
 # ======================================================
 # Deploy schema setup function
@@ -59,6 +61,7 @@ gcloud functions deploy raw-extract \
     --service-account ${SERVICE_ACCOUNT} \
     --region ${REGION} \
     --allow-unauthenticated \
+    --timeout ${TIMEOUT} \
     --memory 512MB \
     --set-env-vars YOUTUBE_API_KEY=$YOUTUBE_API_KEY
 
@@ -80,6 +83,7 @@ gcloud functions deploy raw-parse \
     --service-account ${SERVICE_ACCOUNT} \
     --region ${REGION} \
     --allow-unauthenticated \
+    --timeout ${TIMEOUT} \
     --memory 512MB 
 
 echo "======================================================"
@@ -96,6 +100,7 @@ gcloud functions deploy raw-transform \
     --service-account ${SERVICE_ACCOUNT} \
     --region ${REGION} \
     --allow-unauthenticated \
+    --timeout ${TIMEOUT} \
     --memory 512MB 
 
 echo "======================================================"
@@ -0,0 +1,151 @@
+"""
+Select which already-known videos to refresh, from the staging tables
+"""
+from google.cloud import bigquery
+
+project_id = 'adrineto-qst882-fall25'
+staging = f"{project_id}.youtube_staging"
+
+# Global variable to cache the BigQuery client
+_bq_client = None
+
+
+def get_bq_client():
+    """
+    Lazy initialization of the BigQuery client.
+    """
+    global _bq_client
+
+    if _bq_client is None:
+        _bq_client = bigquery.Client(project=project_id)
+
+    return _bq_client
+
+
+def get_hot_video_ids(max_videos=500, recent_hours=48, growth_days=2):
+    """
+    Videos worth refreshing intraday: published in the last `recent_hours`,
+    or with the largest view gain over the last `growth_days` daily snapshots.
+    Newest videos come first, then the fastest growing.
+    """
+    sql = f"""
+    WITH growth AS (
+      SELECT
+        video_id,
+        MAX(view_count) - MIN(view_count) AS views_gain
+      FROM `{staging}.fact_video_statistics`
+      WHERE date >= DATE_SUB(CURRENT_DATE(), INTERVAL @growth_days DAY)
+      GROUP BY video_id
+    )
+    SELECT v.video_id
+    FROM `{staging}.dim_videos` v
+    LEFT JOIN growth g USING (video_id)
+    WHERE v.published_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @recent_hours HOUR)
+       OR g.views_gain > 0
+    ORDER BY
+      v.published_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @recent_hours HOUR) DESC,
+      g.views_gain DESC
+    LIMIT @max_videos
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("max_videos", "INT64", max_videos),
+        bigquery.ScalarQueryParameter("recent_hours", "INT64", recent_hours),
+        bigquery.ScalarQueryParameter("growth_days", "INT64", growth_days),
+    ])
+    rows = get_bq_client().query(sql, job_config=job_config).result()
+    return [row.video_id for row in rows]
+
+
+def get_tracked_video_ids(shard=0, num_shards=1):
+    """
+    Active (non-retired) videos from the tracked-video registry that belong
+    to this shard. Sharding is a stable hash of video_id, so each video is
+    refreshed by exactly one shard.
+    """
+    sql = f"""
+    SELECT video_id
+    FROM `{staging}.tracked_videos`
+    WHERE retired_at IS NULL
+      AND MOD(ABS(FARM_FINGERPRINT(video_id)), @num_shards) = @shard
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("shard", "INT64", shard),
+        bigquery.ScalarQueryParameter("num_shards", "INT64", num_shards),
+    ])
+    rows = get_bq_client().query(sql, job_config=job_config).result()
+    return [row.video_id for row in rows]
+
+
+def get_refresh_candidates(lookback_days=14):
+    """
+    Inputs for the priority scheduler: every active tracked video with its
+    age, latest view velocity and date of its last stats snapshot, plus the
+    channels those videos belong to with their last update time.
+    """
+    videos_sql = f"""
+    WITH stats AS (
+      SELECT
+        video_id,
+        date,
+        SAFE_DIVIDE(
+          view_count - LAG(view_count) OVER w,
+          DATE_DIFF(date, LAG(date) OVER w, DAY)
+        ) AS views_per_day,
+        ROW_NUMBER() OVER (PARTITION BY video_id ORDER BY date DESC) AS rn
+      FROM `{staging}.fact_video_statistics`
+      WHERE date >= DATE_SUB(CURRENT_DATE(), INTERVAL @lookback_days DAY)
+      WINDOW w AS (PARTITION BY video_id ORDER BY date)
+    )
+    SELECT
+      t.video_id,
+      v.channel_id,
+      t.published_at,
+      s.views_per_day,
+      s.date AS last_stats_date
+    FROM `{staging}.tracked_videos` t
+    LEFT JOIN `{staging}.dim_videos` v ON v.video_id = t.video_id
+    LEFT JOIN stats s ON s.video_id = t.video_id AND s.rn = 1
+    WHERE t.retired_at IS NULL
+    """
+    channels_sql = f"""
+    SELECT c.channel_id, c.last_updated
+    FROM `{staging}.dim_channels` c
+    WHERE c.channel_id IN (
+      SELECT v.channel_id
+      FROM `{staging}.tracked_videos` t
+      JOIN `{staging}.dim_videos` v ON v.video_id = t.video_id
+      WHERE t.retired_at IS NULL
+    )
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("lookback_days", "INT64", lookback_days),
+    ])
+    client = get_bq_client()
+    # Submit both before waiting on either
+    videos_job = client.query(videos_sql, job_config=job_config)
+    channels_job = client.query(channels_sql)
+    return videos_job.to_dataframe(), channels_job.to_dataframe()
+
+
+def get_comment_watermarks(video_ids):
+    """
+    Per-video high-water mark of ingested comments: the (published_at,
+    comment_id) of the newest comment in fact_comments. Videos without
+    any ingested comments are absent from the result.
+    """
+    if not video_ids:
+        return {}
+
+    sql = f"""
+    SELECT
+      video_id,
+      ARRAY_AGG(STRUCT(published_at, comment_id) ORDER BY published_at DESC LIMIT 1)[OFFSET(0)] AS latest
+    FROM `{staging}.fact_comments`
+    WHERE video_id IN UNNEST(@video_ids)
+    GROUP BY video_id
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter("video_ids", "STRING", list(video_ids)),
+    ])
+    rows = get_bq_client().query(sql, job_config=job_config).result()
+    return {row.video_id: (row.latest["published_at"], row.latest["comment_id"]) for row in rows}
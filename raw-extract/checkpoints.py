@@ -0,0 +1,53 @@
+"""
+Per-stage checkpoints for resumable extraction runs.
+
+Each completed unit of work (search results, channel batch, stats batch,
+one video's comments) is written as JSON under the run's GCS prefix:
+  raw/youtube/query=<q>/date=<yyyymmdd>/<run_id>/_checkpoints/<name>.json
+A retry with the same run_id loads finished units instead of spending
+API quota on them again.
+"""
+import json
+from google.cloud import storage
+
+
+class CheckpointStore:
+    def __init__(self, bucket_name, run_prefix):
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = f"{run_prefix}/_checkpoints/"
+        self._existing = None
+
+    def _blob_name(self, name):
+        return f"{self.prefix}{name}.json"
+
+    def existing(self):
+        """
+        Names of the checkpoints already written (one list call per run).
+        """
+        if self._existing is None:
+            self._existing = {
+                blob.name[len(self.prefix):-len(".json")]
+                for blob in self.bucket.list_blobs(prefix=self.prefix)
+            }
+        return self._existing
+
+    def load(self, name):
+        """
+        Records of a finished unit, or None if it has not been checkpointed.
+        """
+        if name not in self.existing():
+            return None
+        return json.loads(self.bucket.blob(self._blob_name(name)).download_as_text())
+
+    def save(self, name, records):
+        self.bucket.blob(self._blob_name(name)).upload_from_string(json.dumps(records, default=str))
+        self.existing().add(name)
+
+    def clear(self):
+        """
+        Remove the checkpoints once the run's data file has been written.
+        """
+        blobs = list(self.bucket.list_blobs(prefix=self.prefix))
+        if blobs:
+            self.bucket.delete_blobs(blobs)
+        self._existing = set()
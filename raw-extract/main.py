@@ -2,12 +2,30 @@
 import functions_framework
 from google.cloud import storage
 import pandas as pd
-import datetime, uuid, json
-from youtube_api import get_video, get_channel_details, get_video_statistics, get_video_comments, get_video_categories
+import datetime, uuid, json, resource
+from youtube_api import get_video, get_video_page, get_channel_details, get_video_statistics, get_video_comments, get_video_categories, units_used
+from tracing import Tracer, logical_date_from
+from candidates import get_hot_video_ids, get_tracked_video_ids, get_refresh_candidates, get_comment_watermarks
+from scheduler import score_videos, build_work_items, allocate_budget
+from checkpoints import CheckpointStore
+from warehouse import archive_in_background, load_raw
 
 project_id = 'adrineto-qst882-fall25'
 bucket_name = 'adrineto-ba882-fall25-team-6'
 
+# Chunked mode: videos per window (one search.list page at most)
+WINDOW_SIZE = 50
+
+# Entity layout: data.json key -> raw table, one NDJSON file per table under
+# raw/youtube/<table>/query=<q>/date=<yyyymmdd>/ (read by youtube_raw.ext_<table>)
+RAW_ENTITIES = {
+    "videos": "videos",
+    "channels": "channels",
+    "comments": "comments",
+    "video_stats": "video_statistics",
+    "categories": "categories",
+}
+
 def upload_to_gcs(bucket_name, path, run_id, data):
     client = storage.Client()
     bucket = client.bucket(bucket_name)
@@ -17,42 +35,228 @@ def upload_to_gcs(bucket_name, path, run_id, data):
     print(f"Uploaded {blob_name} to {bucket_name}")
     return {'bucket_name': bucket_name, 'blob_name': blob_name}
 
-@functions_framework.http
-def task(request):
-    query = request.args.get("query", "NFL")
-    run_id = uuid.uuid4().hex[:12]
-    print(f"Query: {query}, Run ID: {run_id}")
+def entity_blob(table, query, date_path, name):
+    return f"raw/youtube/{table}/query={query}/date={date_path}/{name}.jsonl"
+
+def ndjson_line(record):
+    """
+    One record as strict JSON: missing values (NaN, NaT, inf) become null,
+    since BigQuery rejects the bare NaN/Infinity tokens json.dumps writes.
+    """
+    clean = {
+        k: None if not isinstance(v, (list, dict, tuple)) and (pd.isna(v) or v in (float("inf"), float("-inf"))) else v
+        for k, v in record.items()
+    }
+    return json.dumps(clean, default=str, allow_nan=False) + "\n"
+
+def upload_entities(bucket_name, query, date_path, name, run_id, data, metadata=None):
+    """
+    Write one NDJSON file per entity in the hive layout. Empty entities still
+    get a file so every run is visible in every external table.
+    `metadata` is attached to the videos file (resume marker for chunked runs).
+    """
+    bucket = storage.Client().bucket(bucket_name)
+    blob_names, size = [], 0
+    # videos goes last: its file marks the run (or window) as complete
+    for key, table in sorted(RAW_ENTITIES.items(), key=lambda item: item[1] == "videos"):
+        lines = "".join(ndjson_line({**record, "run_id": run_id}) for record in data.get(key, []))
+        blob = bucket.blob(entity_blob(table, query, date_path, name))
+        if metadata and table == "videos":
+            blob.metadata = metadata
+        blob.upload_from_string(lines, content_type="application/x-ndjson")
+        blob_names.append(blob.name)
+        size += len(lines)
+    print(f"Uploaded {len(blob_names)} entity files for {name} to {bucket_name}")
+    return {'bucket_name': bucket_name, 'entity_files': blob_names}, size
+
+def fused_ingest(data, query, date_path, run_id, tracer, retry=False, dedup_enabled=True):
+    """
+    Load the records straight into the raw tables while the gzip archive of
+    data.json uploads on a background thread. Returns the archive location
+    (with the loaded row counts) and the archived size.
+    """
+    blob_name = f"raw/youtube/query={query}/date={date_path}/{run_id}/data.json"
+    thread, archived = archive_in_background(bucket_name, blob_name, data)
+    logical_date = datetime.datetime.strptime(date_path, "%Y%m%d").date()
+    # A retry may follow an attempt whose loads committed before it failed
+    loaded = load_raw(data, f"gs://{bucket_name}/{blob_name}", run_id, logical_date, tracer,
+                      retry=retry, dedup_enabled=dedup_enabled)
+    thread.join()
+    if "error" in archived:
+        raise RuntimeError(f"Loaded {sum(loaded.values())} rows but archiving failed: {archived['error']}")
+    # Lets a retry of this run_id skip the run (see extract_search)
+    blob = storage.Client().bucket(bucket_name).blob(blob_name)
+    blob.metadata = {"loaded": "true"}
+    blob.patch()
+    return {'bucket_name': bucket_name, 'blob_name': blob_name, 'loaded': loaded}, archived['bytes']
+
+def write_raw(request_json, data, query, date_path, run_id, tracer):
+    """
+    Land a run's raw data: one data.json for raw-parse (default), per-entity
+    NDJSON files for the external tables (`"layout": "entity"`), or loaded
+    directly into the raw tables with the file archived alongside
+    (`"ingest_mode": "fused"`).
+    Returns the GCS location and the uploaded size.
+    """
+    if request_json.get("layout") == "entity":
+        return upload_entities(bucket_name, query, date_path, run_id, run_id, data)
+    if request_json.get("ingest_mode") == "fused":
+        return fused_ingest(data, query, date_path, run_id, tracer, retry=bool(request_json.get("try_number")),
+                            dedup_enabled=bool(request_json.get("dedup", True)))
+    json_str = json.dumps(data, default=str)
+    return upload_to_gcs(bucket_name, f"raw/youtube/query={query}/date={date_path}", run_id, json_str), len(json_str)
+
+def reset_peak_rss():
+    """
+    Reset the kernel's resident-memory high-water mark (VmHWM) so
+    peak_rss_mb() covers only this request; instances are reused across
+    requests (and run one request at a time at the default concurrency).
+    Returns False where /proc/self/clear_refs can't be written.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError as e:
+        print(f"Could not reset peak RSS: {e}")
+        return False
+
+def peak_rss_mb():
+    """
+    High-water mark of resident memory since reset_peak_rss(), in MB (VmHWM
+    is in kB). Falls back to ru_maxrss, the instance's lifetime peak.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def checkpointed(store, name, fetch):
+    """
+    Return a unit's records from its checkpoint, or fetch and checkpoint them.
+    Empty/None results are not checkpointed: the API wrappers return them on
+    errors too, and a retry should try those units again.
+    """
+    records = store.load(name)
+    if records is not None:
+        return pd.DataFrame(records), True
+    df = fetch()
+    if df is not None and not df.empty:
+        store.save(name, df.to_dict(orient="records"))
+    return df, False
+
+def fetch_in_batches(store, name, ids, fetch, batch_size=50):
+    """
+    Call a batched API wrapper 50 IDs at a time, checkpointing each batch.
+    """
+    frames, resumed = [], 0
+    for i in range(0, len(ids), batch_size):
+        df, was_resumed = checkpointed(store, f"{name}/{i // batch_size:04d}", lambda: fetch(ids[i:i + batch_size]))
+        resumed += was_resumed
+        if df is not None and not df.empty:
+            frames.append(df)
+    return (pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()), resumed
+
+def extract_search(request_json, query, run_id, date_path, tracer):
+    """
+    Full extraction for one search query: videos, channels, stats, comments
+    and categories. Returns the GCS location and the uploaded size.
+
+    Resumable: every finished unit is checkpointed under the run's prefix,
+    so a retry with the same run_id only fetches what is still missing.
+    """
+    max_results = int(request_json.get("max_results", 50))
+    max_comments = int(request_json.get("max_comments", 50))
+    max_comments_active = int(request_json.get("max_comments_active", 500))
+    incremental = bool(request_json.get("incremental_comments", True))
+
+    path = f"raw/youtube/query={query}/date={date_path}"
+    run_prefix = f"{path}/{run_id}"
+
+    # A retry after the data file was written has nothing left to do
+    # (in fused mode the archive can land before the loads finish, so it
+    # only counts once it is marked as loaded)
+    if request_json.get("layout") == "entity":
+        done = {'entity_files': [entity_blob(t, query, date_path, run_id) for t in RAW_ENTITIES.values()]}
+        data_blob = storage.Client().bucket(bucket_name).get_blob(done['entity_files'][0])
+    else:
+        data_blob = storage.Client().bucket(bucket_name).get_blob(f"{run_prefix}/data.json")
+        done = {'blob_name': f"{run_prefix}/data.json"}
+    fused = request_json.get("ingest_mode") == "fused" and request_json.get("layout") != "entity"
+    if data_blob is not None and (not fused or (data_blob.metadata or {}).get("loaded")):
+        print(f"Run {run_id} already extracted to {data_blob.name}")
+        if fused:
+            done['loaded'] = {}
+        return {'bucket_name': bucket_name, **done}, 0
+
+    store = CheckpointStore(bucket_name, run_prefix)
 
     # Extract from YouTube
-    videos_df = get_video(query, max_results=50)
-    channel_ids = videos_df["channel_id"].dropna().unique().tolist()
-    channels_df = get_channel_details(channel_ids)
-    stats_df = get_video_statistics(videos_df["video_id"].tolist())
+    with tracer.span("search") as span:
+        before = units_used()
+        videos_df, resumed = checkpointed(store, "search", lambda: get_video(query, max_results=max_results))
+        span.add(rows=len(videos_df), api_units=units_used() - before)
+        span.set(resumed=resumed)
+
+    with tracer.span("channels") as span:
+        before = units_used()
+        channel_ids = videos_df["channel_id"].dropna().unique().tolist()
+        channels_df, resumed = fetch_in_batches(store, "channels", channel_ids, get_channel_details)
+        span.add(rows=len(channels_df), api_units=units_used() - before)
+        span.set(resumed_batches=resumed)
+
+    with tracer.span("video_stats") as span:
+        before = units_used()
+        stats_df, resumed = fetch_in_batches(store, "video_stats", videos_df["video_id"].tolist(), get_video_statistics)
+        span.add(rows=len(stats_df), api_units=units_used() - before)
+        span.set(resumed_batches=resumed)
 
     # Extract comments (try multiple videos until we find one with comments enabled)
     all_comments = []
 
-    if not videos_df.empty:
-        for i in range(len(videos_df)):
-            video_id = videos_df["video_id"].iloc[i]
-            temp_comments = get_video_comments(video_id, max_comments=50)
+    with tracer.span("comments", incremental=incremental) as span:
+        before = units_used()
+        resumed_videos = 0
+        if not videos_df.empty:
+            # Newest comment already ingested per video; pagination stops there
+            watermarks = get_comment_watermarks(videos_df["video_id"].tolist()) if incremental else {}
+            span.set(videos_with_watermark=len(watermarks))
+            for i in range(len(videos_df)):
+                video_id = videos_df["video_id"].iloc[i]
+                temp_comments, resumed = checkpointed(store, f"comments/{video_id}", lambda: get_video_comments(
+                    video_id,
+                    max_comments=max_comments,
+                    since=watermarks.get(video_id),
+                    max_comments_active=max_comments_active,
+                ))
+                resumed_videos += resumed
+                
+                if temp_comments is not None and not temp_comments.empty:
+                    all_comments.append(temp_comments)
+                else:
+                    print(f"No comments found or comments disabled for video {video_id}")
             
-            if temp_comments is not None and not temp_comments.empty:
-                all_comments.append(temp_comments)
-            else:
-                print(f"No comments found or comments disabled for video {video_id}")
-        
-        # Combine all comments into a single DataFrame (if any found)
-        comments_df = pd.concat(all_comments, ignore_index=True) if all_comments else None
-    else:
-        comments_df = None
+            # Combine all comments into a single DataFrame (if any found)
+            comments_df = pd.concat(all_comments, ignore_index=True) if all_comments else None
+        else:
+            comments_df = None
+        span.add(rows=len(comments_df) if comments_df is not None else 0, api_units=units_used() - before)
+        span.set(resumed_videos=resumed_videos)
 
     if comments_df is not None:
         print(f"Successfully fetched {len(comments_df)} comments across {len(all_comments)} videos.")
     else:
         print("No comments available for any of the selected videos.")
 
-    categories_df = get_video_categories(region_code="US")
+    with tracer.span("categories") as span:
+        before = units_used()
+        categories_df, resumed = checkpointed(store, "categories", lambda: get_video_categories(region_code="US"))
+        span.add(rows=len(categories_df), api_units=units_used() - before)
+        span.set(resumed=resumed)
 
     data = {
         "query": query,
@@ -64,8 +268,277 @@ def task(request):
         "extracted_at": datetime.datetime.utcnow().isoformat()
     }
 
-    json_str = json.dumps(data, default=str)
-    date_path = datetime.datetime.utcnow().strftime("%Y%m%d")
-    gcs_path = upload_to_gcs(bucket_name, f"raw/youtube/query={query}/date={date_path}", run_id, json_str)
+    with tracer.span("upload_gcs") as span:
+        gcs_path, size = write_raw(request_json, data, query, date_path, run_id, tracer)
+        span.add(bytes=size)
+
+    # The data file now holds everything the checkpoints did
+    store.clear()
+
+    return gcs_path, size
+
+def extract_search_chunked(request_json, query, run_id, date_path, tracer):
+    """
+    Extraction for large result sets, one window of videos at a time:
+    search page -> stats -> channels -> comments, then the window is written
+    as its own part file and dropped from memory. Peak memory is bounded by
+    the window size instead of `max_videos`.
+
+    Resumable: each part records the next search page token in its GCS
+    metadata, so a retry with the same run_id continues after the last part.
+    """
+    max_videos = int(request_json.get("max_videos", 500))
+    window_size = min(int(request_json.get("window_size", WINDOW_SIZE)), WINDOW_SIZE)
+    max_comments = int(request_json.get("max_comments", 50))
+    max_comments_active = int(request_json.get("max_comments_active", 500))
+    incremental = bool(request_json.get("incremental_comments", True))
+
+    run_prefix = f"raw/youtube/query={query}/date={date_path}/{run_id}"
+    bucket = storage.Client().bucket(bucket_name)
+
+    # Entity layout: each window writes <run_id>-NNNNN.jsonl per entity and
+    # the videos file carries the resume metadata
+    entity = request_json.get("layout") == "entity"
+    key = 'entity_files' if entity else 'blob_names'
+    part_prefix = entity_blob("videos", query, date_path, f"{run_id}-")[:-len(".jsonl")] if entity else f"{run_prefix}/part-"
+
+    # Parts written by an earlier attempt of this run
+    parts = sorted(bucket.list_blobs(prefix=part_prefix), key=lambda b: b.name)
+    blob_names = [b.name for b in parts]
+    page_token, fetched = None, 0
+    if parts:
+        meta = parts[-1].metadata or {}
+        page_token = meta.get("next_page_token") or None
+        fetched = int(meta.get("videos_total", 0))
+        print(f"Resuming run {run_id} after {len(parts)} parts ({fetched} videos)")
+        if page_token is None or fetched >= max_videos:
+            return {'bucket_name': bucket_name, key: blob_names}, 0
+
+    seen_channels = set()
+    uploaded_bytes = 0
+    window = len(parts)
+    while fetched < max_videos:
+        with tracer.span("window", window=window) as span:
+            before = units_used()
+            videos_df, page_token = get_video_page(query, page_token, max_results=min(window_size, max_videos - fetched))
+            if videos_df.empty:
+                break
+            fetched += len(videos_df)
+            video_ids = videos_df["video_id"].tolist()
+
+            stats_df = get_video_statistics(video_ids)
+
+            # Channels already fetched by an earlier window of this call are skipped
+            channel_ids = [c for c in videos_df["channel_id"].dropna().unique() if c not in seen_channels]
+            channels_df = get_channel_details(channel_ids)
+            seen_channels.update(channel_ids)
+
+            watermarks = get_comment_watermarks(video_ids) if incremental else {}
+            all_comments = [
+                get_video_comments(
+                    video_id,
+                    max_comments=max_comments,
+                    since=watermarks.get(video_id),
+                    max_comments_active=max_comments_active,
+                )
+                for video_id in video_ids
+            ]
+            all_comments = [df for df in all_comments if df is not None and not df.empty]
+            comments_df = pd.concat(all_comments, ignore_index=True) if all_comments else pd.DataFrame()
+
+            # Categories are the same for every window; the first part carries them
+            categories_df = get_video_categories(region_code="US") if window == 0 else pd.DataFrame()
 
-    return {"run_id": run_id, **gcs_path}, 200
+            data = {
+                "query": query,
+                "videos": videos_df.to_dict(orient="records"),
+                "channels": channels_df.to_dict(orient="records"),
+                "video_stats": stats_df.to_dict(orient="records"),
+                "comments": comments_df.to_dict(orient="records"),
+                "categories": categories_df.to_dict(orient="records"),
+                "extracted_at": datetime.datetime.utcnow().isoformat()
+            }
+            metadata = {"next_page_token": page_token or "", "videos_total": str(fetched)}
+            if entity:
+                written, size = upload_entities(bucket_name, query, date_path, f"{run_id}-{window:05d}", run_id, data, metadata)
+                blob_names.extend(written['entity_files'])
+            else:
+                json_str = json.dumps(data, default=str)
+                blob = bucket.blob(f"{run_prefix}/part-{window:05d}.json")
+                blob.metadata = metadata
+                blob.upload_from_string(json_str)
+                blob_names.append(blob.name)
+                size = len(json_str)
+                del json_str
+            uploaded_bytes += size
+
+            span.add(
+                rows=len(videos_df) + len(stats_df) + len(channels_df) + len(comments_df),
+                api_units=units_used() - before,
+                bytes=size,
+            )
+            span.set(videos=len(videos_df), comments=len(comments_df), peak_rss_mb=peak_rss_mb())
+            print(f"Wrote window {window}: {len(videos_df)} videos, {len(comments_df)} comments")
+
+            # Drop the window before fetching the next page
+            del data, videos_df, stats_df, channels_df, comments_df, all_comments
+
+        window += 1
+        if page_token is None:
+            break
+
+    return {'bucket_name': bucket_name, key: blob_names}, uploaded_bytes
+
+def refresh_statistics(request_json, video_ids, label, run_id, date_path, tracer):
+    """
+    Statistics-only refresh for known videos (1 API unit per 50 IDs).
+    Lands a regular raw file in which only `video_stats` is populated.
+    """
+    with tracer.span("video_stats", videos=len(video_ids)) as span:
+        before = units_used()
+        stats_df = get_video_statistics(video_ids)
+        span.add(rows=len(stats_df), api_units=units_used() - before)
+
+    data = {
+        "query": label,
+        "videos": [],
+        "channels": [],
+        "video_stats": stats_df.to_dict(orient="records"),
+        "comments": [],
+        "categories": [],
+        "extracted_at": datetime.datetime.utcnow().isoformat()
+    }
+
+    with tracer.span("upload_gcs") as span:
+        gcs_path, size = write_raw(request_json, data, label, date_path, run_id, tracer)
+        span.add(bytes=size)
+
+    return gcs_path, size
+
+def extract_hot_stats(request_json, run_id, date_path, tracer):
+    """
+    Intraday refresh of the hot set (recently published or fast-growing videos).
+    """
+    with tracer.span("select_videos", mode="hot_stats") as span:
+        video_ids = get_hot_video_ids(
+            max_videos=int(request_json.get("max_videos", 500)),
+            recent_hours=int(request_json.get("recent_hours", 48)),
+        )
+        span.add(rows=len(video_ids))
+    print(f"Hot set: {len(video_ids)} videos")
+    return refresh_statistics(request_json, video_ids, "hot_set", run_id, date_path, tracer)
+
+def extract_tracked_stats(request_json, run_id, date_path, tracer):
+    """
+    Daily refresh of one shard of the tracked-video registry.
+    """
+    shard = int(request_json.get("shard", 0))
+    num_shards = int(request_json.get("num_shards", 1))
+    with tracer.span("select_videos", mode="tracked_stats", shard=shard, num_shards=num_shards) as span:
+        video_ids = get_tracked_video_ids(shard, num_shards)
+        span.add(rows=len(video_ids))
+    print(f"Tracked shard {shard}/{num_shards}: {len(video_ids)} videos")
+    return refresh_statistics(request_json, video_ids, tracked_label(shard, num_shards), run_id, date_path, tracer)
+
+def extract_scheduled(request_json, run_id, date_path, tracer):
+    """
+    Spend a fixed unit budget on the most valuable stats, comment and channel
+    refreshes across the tracked universe (see scheduler.py).
+    """
+    budget_units = int(request_json.get("budget_units", 2000))
+
+    with tracer.span("plan", mode="scheduled", budget_units=budget_units) as span:
+        videos, channels = get_refresh_candidates()
+        work = build_work_items(score_videos(videos), channels)
+        plan, planned_units = allocate_budget(work, budget_units)
+        span.add(rows=len(work))
+        span.set(planned_units=planned_units, **{kind: len(ids) for kind, ids in plan.items()})
+    print(f"Refresh plan ({planned_units}/{budget_units} units): "
+          + ", ".join(f"{len(ids)} {kind}" for kind, ids in plan.items()))
+
+    with tracer.span("video_stats", videos=len(plan["stats"])) as span:
+        before = units_used()
+        stats_df = get_video_statistics(plan["stats"])
+        span.add(rows=len(stats_df), api_units=units_used() - before)
+
+    with tracer.span("channels") as span:
+        before = units_used()
+        channels_df = get_channel_details(plan["channels"])
+        span.add(rows=len(channels_df), api_units=units_used() - before)
+
+    with tracer.span("comments") as span:
+        before = units_used()
+        # One page per planned video, matching the one unit the plan charged
+        watermarks = get_comment_watermarks(plan["comments"])
+        all_comments = [
+            get_video_comments(video_id, max_comments=100, since=watermarks.get(video_id))
+            for video_id in plan["comments"]
+        ]
+        all_comments = [df for df in all_comments if df is not None and not df.empty]
+        comments_df = pd.concat(all_comments, ignore_index=True) if all_comments else pd.DataFrame()
+        span.add(rows=len(comments_df), api_units=units_used() - before)
+
+    data = {
+        "query": "scheduled",
+        "videos": [],
+        "channels": channels_df.to_dict(orient="records"),
+        "video_stats": stats_df.to_dict(orient="records"),
+        "comments": comments_df.to_dict(orient="records"),
+        "categories": [],
+        "extracted_at": datetime.datetime.utcnow().isoformat()
+    }
+
+    with tracer.span("upload_gcs") as span:
+        gcs_path, size = write_raw(request_json, data, "scheduled", date_path, run_id, tracer)
+        span.add(bytes=size)
+
+    return gcs_path, size
+
+def tracked_label(shard, num_shards):
+    """
+    Stands in for the search query in the raw layout, e.g. query=tracked-3-of-8.
+    """
+    return f"tracked-{shard}-of-{num_shards}"
+
+@functions_framework.http
+def task(request):
+    # The DAG sends a JSON body; query-string args are kept for manual calls
+    request_json = request.get_json(silent=True) or {}
+    mode = request_json.get("mode", "search")
+    query = request_json.get("query") or request.args.get("query", "NFL")
+    # Reuse the DAG's run_id so every stage of a run can be traced together
+    run_id = request_json.get("run_id") or uuid.uuid4().hex[:12]
+    # Land under the DAG's logical date so parse/transform/backfill agree on the partition
+    date_path = request_json.get("date") or datetime.datetime.utcnow().strftime("%Y%m%d")
+    print(f"Mode: {mode}, Query: {query}, Run ID: {run_id}")
+    reset_peak_rss()
+
+    modes = {
+        "search": lambda: (extract_search_chunked if request_json.get("chunked") else extract_search)(
+            request_json, query, run_id, date_path, tracer),
+        "hot_stats": lambda: extract_hot_stats(request_json, run_id, date_path, tracer),
+        "tracked_stats": lambda: extract_tracked_stats(request_json, run_id, date_path, tracer),
+        "scheduled": lambda: extract_scheduled(request_json, run_id, date_path, tracer),
+    }
+    if mode not in modes:
+        return {"status": "failed", "error": f"Unknown mode: {mode}"}, 400
+
+    tracer = Tracer(run_id, "extract", logical_date_from(date_path))
+    units_at_start = units_used()
+    try:
+        with tracer.span("extract", mode=mode, query=query) as total:
+            total.add(retries=request_json.get("try_number", 0))
+            gcs_path, uploaded_bytes = modes[mode]()
+            total.add(api_units=units_used() - units_at_start, bytes=uploaded_bytes)
+            total.set(peak_rss_mb=peak_rss_mb())
+    finally:
+        trace = tracer.summary()
+        tracer.flush()
+
+    if mode == "search":
+        label = query
+    elif mode == "tracked_stats":
+        label = tracked_label(int(request_json.get("shard", 0)), int(request_json.get("num_shards", 1)))
+    else:
+        label = mode
+    return {"run_id": run_id, "query": label, "mode": mode, **gcs_path, "peak_rss_mb": peak_rss_mb(), "trace": trace}, 200
@@ -0,0 +1,108 @@
+"""
+Priority-based refresh scheduler.
+
+Scores refresh candidates by age, recent view velocity and staleness, then
+spends a run's API unit budget on the highest-value work first:
+  stats     videos.list          1 unit per 50 videos
+  comments  commentThreads.list  1 unit per video (one page)
+  channels  channels.list        1 unit per 50 channels
+"""
+import math
+import pandas as pd
+
+# Relative weight of each signal in a video's score (sums to 1)
+WEIGHTS = {
+    'velocity': 0.5,
+    'freshness': 0.3,
+    'staleness': 0.2,
+}
+
+# A video's freshness halves every FRESHNESS_HALF_LIFE_DAYS after publishing
+FRESHNESS_HALF_LIFE_DAYS = 7
+
+# Staleness saturates once stats are this many days old (or never fetched)
+STALENESS_TARGET_DAYS = 3
+
+# Comments and channel metadata matter less than the view time series
+COMMENTS_WEIGHT = 0.5
+CHANNELS_WEIGHT = 0.3
+
+# Units per API call and how many IDs one call covers
+BATCH_SIZE = {'stats': 50, 'comments': 1, 'channels': 50}
+
+
+def score_videos(videos, now=None):
+    """
+    Add a `score` column in [0, 1] to a DataFrame of candidate videos with
+    published_at, views_per_day and last_stats_date columns.
+    """
+    now = now or pd.Timestamp.now(tz='UTC')
+    df = videos.copy()
+
+    published = pd.to_datetime(df['published_at'], utc=True, errors='coerce')
+    age_days = ((now - published).dt.total_seconds() / 86400).fillna(365).clip(lower=0)
+    freshness = 0.5 ** (age_days / FRESHNESS_HALF_LIFE_DAYS)
+
+    # log scale so one viral video doesn't flatten everyone else to zero
+    velocity = df['views_per_day'].astype(float).fillna(0).clip(lower=0).map(math.log1p)
+    if velocity.max() > 0:
+        velocity = velocity / velocity.max()
+
+    last_stats = pd.to_datetime(df['last_stats_date'], utc=True, errors='coerce')
+    stale_days = ((now - last_stats).dt.total_seconds() / 86400).fillna(STALENESS_TARGET_DAYS)
+    staleness = (stale_days / STALENESS_TARGET_DAYS).clip(0, 1)
+
+    df['score'] = (
+        WEIGHTS['velocity'] * velocity
+        + WEIGHTS['freshness'] * freshness
+        + WEIGHTS['staleness'] * staleness
+    )
+    return df
+
+
+def build_work_items(videos, channels=None):
+    """
+    Turn scored videos (and optionally channels with a last_updated column)
+    into refresh work items with a value per item.
+    """
+    items = [
+        pd.DataFrame({'kind': 'stats', 'id': videos['video_id'], 'value': videos['score']}),
+        pd.DataFrame({'kind': 'comments', 'id': videos['video_id'], 'value': videos['score'] * COMMENTS_WEIGHT}),
+    ]
+
+    if channels is not None and not channels.empty and 'channel_id' in videos:
+        # A channel is worth as much as its best video, scaled by how stale it is
+        best = videos.groupby('channel_id')['score'].max()
+        ch = channels.set_index('channel_id')
+        last_updated = pd.to_datetime(ch['last_updated'], utc=True, errors='coerce')
+        stale_days = ((pd.Timestamp.now(tz='UTC') - last_updated).dt.total_seconds() / 86400).fillna(STALENESS_TARGET_DAYS)
+        staleness = (stale_days / STALENESS_TARGET_DAYS).clip(0, 1)
+        value = (best.reindex(ch.index).fillna(0) * staleness * CHANNELS_WEIGHT)
+        items.append(pd.DataFrame({'kind': 'channels', 'id': ch.index, 'value': value.values}))
+
+    work = pd.concat(items, ignore_index=True)
+    work['cost'] = work['kind'].map(lambda k: 1 / BATCH_SIZE[k])
+    return work[work['value'] > 0]
+
+
+def allocate_budget(work, budget_units):
+    """
+    Greedily pick work items by value per unit until the budget is spent.
+    Batched kinds are charged per started batch of IDs, so the plan never
+    exceeds budget_units real API units.
+    Returns {kind: [ids]} and the units the plan will use.
+    """
+    plan = {kind: [] for kind in BATCH_SIZE}
+    if work.empty or budget_units <= 0:
+        return plan, 0
+
+    ranked = work.assign(priority=work['value'] / work['cost']).sort_values('priority', ascending=False)
+    units = 0
+    for kind, item_id in zip(ranked['kind'], ranked['id']):
+        # Starting a new batch costs one unit; filling an open batch is free
+        extra = 1 if len(plan[kind]) % BATCH_SIZE[kind] == 0 else 0
+        if units + extra > budget_units:
+            continue
+        plan[kind].append(item_id)
+        units += extra
+    return plan, units
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The function's modules are imported top-level (as Cloud Functions runs them)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,97 @@
+"""Incremental comment paging stops at the watermark without dropping new comments."""
+
+import pytest
+import youtube_api
+from youtube_api import get_video_comments
+
+T0 = "2025-10-01T11:59:59Z"
+T1 = "2025-10-01T12:00:00Z"  # watermark second
+T2 = "2025-10-01T12:00:05Z"
+T3 = "2025-10-01T12:00:09Z"
+
+
+def comment(comment_id, published_at):
+    return {
+        "id": comment_id,
+        "snippet": {"topLevelComment": {"snippet": {
+            "publishedAt": published_at,
+            "authorDisplayName": "a",
+            "textDisplay": "t",
+            "likeCount": 0,
+        }}},
+    }
+
+
+class FakeRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class FakeYouTube:
+    """commentThreads().list() serving `pages` in order, newest first."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def commentThreads(self):
+        return self
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        page = len(self.calls) - 1
+        response = {"items": self.pages[page]}
+        if page + 1 < len(self.pages):
+            response["nextPageToken"] = f"page-{page + 1}"
+        return FakeRequest(response)
+
+
+@pytest.fixture
+def youtube(monkeypatch):
+    def install(pages):
+        fake = FakeYouTube(pages)
+        monkeypatch.setattr(youtube_api, "get_youtube_client", lambda: fake)
+        return fake
+    return install
+
+
+def ids(df):
+    return [] if df is None else df["comment_id"].tolist()
+
+
+def test_stops_at_watermark_comment(youtube):
+    youtube([[comment("c3", T3), comment("c2", T2), comment("c1", T1), comment("c0", T0)]])
+    assert ids(get_video_comments("v", since=(T1, "c1"))) == ["c3", "c2"]
+
+
+def test_keeps_new_comment_from_the_watermark_second(youtube):
+    youtube([[comment("c2", T2), comment("c1b", T1), comment("c1", T1), comment("c0", T0)]])
+    assert ids(get_video_comments("v", since=(T1, "c1"))) == ["c2", "c1b"]
+
+
+def test_stops_at_older_timestamp_when_watermark_comment_is_gone(youtube):
+    # e.g. the watermark comment was deleted
+    youtube([[comment("c2", T2), comment("c0", T0)]])
+    assert ids(get_video_comments("v", since=(T1, "c1"))) == ["c2"]
+
+
+def test_active_video_pages_up_to_max_comments_active(youtube):
+    fake = youtube([
+        [comment("c9", T3), comment("c8", T3)],
+        [comment("c7", T3), comment("c6", T3)],
+        [comment("c5", T3), comment("c4", T3)],
+    ])
+    df = get_video_comments("v", max_comments=2, since=(T0, "c0"), max_comments_active=4)
+    assert ids(df) == ["c9", "c8", "c7", "c6"]
+    assert [call["maxResults"] for call in fake.calls] == [2, 2]
+
+
+def test_first_load_is_capped_at_max_comments(youtube):
+    # No watermark yet: max_comments_active doesn't apply
+    fake = youtube([[comment("c9", T3), comment("c8", T3)], [comment("c7", T3)]])
+    df = get_video_comments("v", max_comments=2, max_comments_active=4)
+    assert ids(df) == ["c9", "c8"]
+    assert len(fake.calls) == 1
@@ -0,0 +1,63 @@
+"""Budget allocation charges batched kinds per started batch of IDs."""
+
+import pandas as pd
+from scheduler import BATCH_SIZE, allocate_budget
+
+
+def work_items(kind, n, value=1.0, prefix=None):
+    return pd.DataFrame({
+        "kind": kind,
+        "id": [f"{prefix or kind}-{i}" for i in range(n)],
+        "value": value,
+        "cost": 1 / BATCH_SIZE[kind],
+    })
+
+
+def test_stats_are_charged_per_batch_of_50():
+    plan, units = allocate_budget(work_items("stats", 120), budget_units=2)
+    assert len(plan["stats"]) == 100
+    assert units == 2
+
+
+def test_partial_batch_costs_a_full_unit():
+    plan, units = allocate_budget(work_items("stats", 51), budget_units=5)
+    assert len(plan["stats"]) == 51
+    assert units == 2
+
+
+def test_comments_cost_one_unit_each():
+    plan, units = allocate_budget(work_items("comments", 5), budget_units=3)
+    assert len(plan["comments"]) == 3
+    assert units == 3
+
+
+def test_mixed_plan_never_exceeds_budget():
+    work = pd.concat([
+        work_items("comments", 10, value=0.9),
+        work_items("stats", 200, value=0.5),
+        work_items("channels", 60, value=0.2),
+    ], ignore_index=True)
+    plan, units = allocate_budget(work, budget_units=4)
+    assert units <= 4
+    charged = sum(
+        -(-len(ids) // BATCH_SIZE[kind])  # started batches
+        for kind, ids in plan.items()
+    )
+    assert charged == units
+
+
+def test_higher_value_per_unit_goes_first():
+    # One stats batch (50 IDs, 1 unit) is worth more per unit than one comment page
+    work = pd.concat([
+        work_items("comments", 1, value=1.0),
+        work_items("stats", 50, value=0.5),
+    ], ignore_index=True)
+    plan, units = allocate_budget(work, budget_units=1)
+    assert len(plan["stats"]) == 50
+    assert plan["comments"] == []
+    assert units == 1
+
+
+def test_no_budget_or_no_work():
+    assert allocate_budget(work_items("stats", 3), 0) == ({k: [] for k in BATCH_SIZE}, 0)
+    assert allocate_budget(work_items("stats", 0), 10) == ({k: [] for k in BATCH_SIZE}, 0)
@@ -0,0 +1,157 @@
+"""
+Fused ingest: load extracted records straight into the youtube_raw tables.
+
+Same row layout as raw-parse (ingest_timestamp, source_path, run_id and
+logical_date stamped on every row), but the DataFrames go to BigQuery as
+Arrow/Parquet without the JSON round trip through GCS. The raw file is
+still archived (gzip) so backfills can reload the run.
+"""
+import gzip
+import json
+import threading
+import pandas as pd
+from datetime import datetime
+from google.cloud import bigquery, storage
+from dedup import DEDUP_KEYS, INDEX_TABLE, dedup
+
+project_id = 'adrineto-qst882-fall25'
+dataset_id = 'youtube_raw'
+
+# data.json key -> raw table
+ENTITIES = {
+    'videos': 'videos',
+    'channels': 'channels',
+    'comments': 'comments',
+    'video_stats': 'video_statistics',
+    'categories': 'categories',
+}
+
+TIMESTAMP_COLUMNS = ['published_at', 'updated_at', 'created_at', 'collected_at']
+
+# Global variable to cache the BigQuery client
+_bq_client = None
+
+
+def get_bq_client():
+    """
+    Lazy initialization of the BigQuery client.
+    """
+    global _bq_client
+
+    if _bq_client is None:
+        _bq_client = bigquery.Client(project=project_id)
+
+    return _bq_client
+
+
+def archive_in_background(bucket_name, blob_name, data):
+    """
+    Upload the run's raw file gzip-compressed on a separate thread.
+    The caller must join() the thread before returning from the request:
+    Cloud Functions throttles CPU once the response is sent.
+    """
+    result = {}
+
+    def upload():
+        body = gzip.compress(json.dumps(data, default=str).encode('utf-8'))
+        blob = storage.Client().bucket(bucket_name).blob(blob_name)
+        # Served decompressed to readers (raw-parse backfills read it as data.json)
+        blob.content_encoding = 'gzip'
+        blob.upload_from_string(body, content_type='application/json')
+        result['bytes'] = len(body)
+        print(f"Archived {blob_name} ({len(body)} bytes gzip)")
+
+    def run():
+        try:
+            upload()
+        except Exception as e:
+            result['error'] = str(e)
+            print(f"Archive of {blob_name} failed: {e}")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, result
+
+
+def clear_previous_load(client, source_path, logical_date, tracer):
+    """
+    Delete rows an earlier attempt loaded from `source_path`, as raw-parse
+    does for backfills, so a retried fused load doesn't append them twice.
+    """
+    script = "\n".join(
+        f"DELETE FROM `{project_id}.{dataset_id}.{table_name}` WHERE logical_date = @d AND source_path = @p;"
+        for table_name in ENTITIES.values()
+    )
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("d", "DATE", logical_date),
+        bigquery.ScalarQueryParameter("p", "STRING", source_path),
+    ])
+    with tracer.span("clear_previous_load") as span:
+        job = client.query(script, job_config=job_config)
+        job.result()
+        span.set(job_id=job.job_id)
+    print(f"Cleared earlier loads of {source_path}")
+
+
+def load_raw(data, source_path, run_id, logical_date, tracer, retry=False, dedup_enabled=True):
+    """
+    Load every non-empty entity of `data` into its raw table. All load jobs
+    are submitted before waiting on any of them. On a retry, rows an earlier
+    attempt loaded from the same source_path are deleted first (source_path
+    holds the run_id, so a first attempt has none).
+    Records are deduplicated against the ingest index like raw-parse does,
+    and their index rows are appended once every data load succeeded.
+    Returns the number of rows loaded per table.
+    """
+    client = get_bq_client()
+    if retry:
+        clear_previous_load(client, source_path, logical_date, tracer)
+    ingest_ts = datetime.utcnow()
+    job_config = bigquery.LoadJobConfig(write_disposition='WRITE_APPEND')
+
+    jobs = {}
+    index_frames = []
+    for key, table_name in ENTITIES.items():
+        df = pd.DataFrame(data.get(key, []))
+        if df.empty:
+            continue
+        df['ingest_timestamp'] = ingest_ts
+        df['source_path'] = source_path
+        df['run_id'] = run_id
+        df['logical_date'] = logical_date
+        # Hash before the timestamp conversion, as raw-parse does, so both
+        # paths hash a record the same way
+        if dedup_enabled and table_name in DEDUP_KEYS:
+            with tracer.span(f"dedup_{table_name}", table=table_name) as span:
+                total = len(df)
+                df, index_rows = dedup(client, table_name, df)
+                span.add(rows=len(df))
+                span.set(skipped=total - len(df))
+            if not index_rows.empty:
+                index_frames.append(index_rows)
+            if df.empty:
+                continue
+        for col in TIMESTAMP_COLUMNS:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col], errors='coerce')
+        table_id = f"{project_id}.{dataset_id}.{table_name}"
+        jobs[table_name] = (client.load_table_from_dataframe(df, table_id, job_config=job_config), len(df))
+
+    loaded = {}
+    for table_name, (job, rows) in jobs.items():
+        with tracer.span(f"load_{table_name}", table=table_name) as span:
+            job.result()
+            span.add(rows=rows, bytes=job.output_bytes or 0)
+            span.set(job_id=job.job_id)
+        loaded[table_name] = rows
+        print(f"Loaded {rows} rows into {table_name}")
+
+    # Only now: the index must never list records that did not land
+    if index_frames:
+        index_rows = pd.concat(index_frames, ignore_index=True)
+        with tracer.span(f"load_{INDEX_TABLE}", table=INDEX_TABLE) as span:
+            job = client.load_table_from_dataframe(index_rows, f"{project_id}.{dataset_id}.{INDEX_TABLE}", job_config=job_config)
+            job.result()
+            span.add(rows=len(index_rows), bytes=job.output_bytes or 0)
+            span.set(job_id=job.job_id)
+    return loaded
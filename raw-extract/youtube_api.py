@@ -14,9 +14,37 @@ project_id = 'adrineto-qst882-fall25'
 secret_id = 'YOUTUBE_API_KEY'
 version_id = 'latest'
 
+# Quota cost (units) of each API method we call
+QUOTA_COSTS = {
+    'search.list': 100,
+    'videos.list': 1,
+    'channels.list': 1,
+    'commentThreads.list': 1,
+    'videoCategories.list': 1,
+}
+
 # Global variable to cache the YouTube client
 _youtube_client = None
 
+# Units spent by this process (quota is charged even when a call fails)
+_units_used = 0
+
+
+def execute(request, method):
+    """
+    Execute an API request and count its quota cost.
+    """
+    global _units_used
+    _units_used += QUOTA_COSTS.get(method, 1)
+    return request.execute()
+
+
+def units_used():
+    """
+    Quota units spent by this process so far.
+    """
+    return _units_used
+
 
 def get_youtube_client():
     """
@@ -45,15 +73,25 @@ def get_video(query, max_results=50, order='relevance'):
     Search for videos by keyword.
     Returns DataFrame with video metadata.
     """
+    videos_df, _ = get_video_page(query, max_results=max_results, order=order)
+    return videos_df
+
+
+def get_video_page(query, page_token=None, max_results=50, order='relevance'):
+    """
+    Fetch one page of search results.
+    Returns (DataFrame with video metadata, token of the next page or None).
+    """
     try:
         youtube = get_youtube_client()
-        response = youtube.search().list(
+        response = execute(youtube.search().list(
             q=query,
             part='id,snippet',
             maxResults=min(max_results, 50),
+            pageToken=page_token,
             type='video',
             order='date'
-        ).execute()
+        ), 'search.list')
 
         videos = []
         for item in response.get('items', []):
@@ -68,11 +106,11 @@ def get_video(query, max_results=50, order='relevance'):
                 'search_order': order
             })
         
-        return pd.DataFrame(videos)
+        return pd.DataFrame(videos), response.get('nextPageToken')
     
     except Exception as e:
         print(f"Error in get_video: {str(e)}")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
 
 
 def get_channel_details(channel_ids):
@@ -89,10 +127,10 @@ def get_channel_details(channel_ids):
         all_channels = []
         for i in range(0, len(channel_ids), 50):
             batch = channel_ids[i:i+50]
-            response = youtube.channels().list(
+            response = execute(youtube.channels().list(
                 part="snippet,statistics",
                 id=",".join(batch)
-            ).execute()
+            ), 'channels.list')
 
             for item in response.get('items', []):
                 snippet = item['snippet']
@@ -128,10 +166,10 @@ def get_video_statistics(video_ids):
         all_stats = []
         for i in range(0, len(video_ids), 50):
             batch = video_ids[i:i+50]
-            response = youtube.videos().list(
+            response = execute(youtube.videos().list(
                 part="statistics,snippet,contentDetails",
                 id=",".join(batch)
-            ).execute()
+            ), 'videos.list')
 
             for item in response.get('items', []):
                 stats = item['statistics']
@@ -156,10 +194,19 @@ def get_video_statistics(video_ids):
         print(f"Error in get_video_statistics: {str(e)}")
         return pd.DataFrame()
 
-def get_video_comments(video_id, max_comments=50):
+def get_video_comments(video_id, max_comments=50, since=None, max_comments_active=None):
     """
     Retrieve top-level comments for a video.
     Returns DataFrame with comment data, or None if comments are disabled.
+
+    Incremental mode (`since` = (published_at, comment_id) of the newest
+    comment already ingested): pages newest-first and stops at that comment
+    or at the first one older than its timestamp. Comments from the same
+    second as the mark are fetched again (publishedAt has one-second
+    resolution, so a new one may share it); the dim_comments MERGE drops the
+    repeats. If a video is still
+    producing new comments when `max_comments` is reached, pagination may
+    continue up to `max_comments_active`.
     """
     if not video_id:
         return None
@@ -169,18 +216,32 @@ def get_video_comments(video_id, max_comments=50):
         comments = []
         next_page_token = None
         total_fetched = 0
+        reached_seen = False
 
-        while total_fetched < max_comments:
-            response = youtube.commentThreads().list(
+        since_ts, since_id = since if since else (None, None)
+        if since_ts is not None:
+            since_ts = pd.Timestamp(since_ts)
+            since_ts = since_ts.tz_localize("UTC") if since_ts.tzinfo is None else since_ts
+        limit = max_comments
+
+        while total_fetched < limit:
+            response = execute(youtube.commentThreads().list(
                 part="snippet",
                 videoId=video_id,
-                maxResults=min(100, max_comments - total_fetched),
+                maxResults=min(100, limit - total_fetched),
                 pageToken=next_page_token,
+                order="time",  # newest first, so incremental mode can stop early
                 textFormat="plainText"
-            ).execute()
+            ), 'commentThreads.list')
 
             for item in response.get("items", []):
                 snippet = item["snippet"]["topLevelComment"]["snippet"]
+                if since and (
+                    item["id"] == since_id
+                    or (since_ts is not None and pd.Timestamp(snippet.get("publishedAt")) < since_ts)
+                ):
+                    reached_seen = True
+                    break
                 comments.append({
                     "video_id": video_id,
                     "comment_id": item["id"],
@@ -193,8 +254,12 @@ def get_video_comments(video_id, max_comments=50):
             total_fetched += len(response.get("items", []))
             next_page_token = response.get("nextPageToken")
 
-            if not next_page_token:
+            if reached_seen or not next_page_token:
                 break
+
+            # Everything so far was new: this video is active, keep paging deeper
+            if since and max_comments_active and total_fetched >= limit:
+                limit = max(limit, max_comments_active)
         
         return pd.DataFrame(comments) if comments else None
     
@@ -219,10 +284,10 @@ def get_video_categories(region_code="US"):
     """
     try:
         youtube = get_youtube_client()
-        response = youtube.videoCategories().list(
+        response = execute(youtube.videoCategories().list(
             part="snippet",
             regionCode=region_code
-        ).execute()
+        ), 'videoCategories.list')
 
         categories = []
         for item in response.get("items", []):
@@ -5,11 +5,75 @@ Load YouTube data from GCS to BigQuery
 import functions_framework
 from google.cloud import storage, bigquery
 import pandas as pd
-import json
+import json, re, uuid
 from datetime import datetime
+from tracing import Tracer, logical_date_from
+from dedup import DEDUP_KEYS, INDEX_TABLE, dedup
 
 project_id = 'adrineto-qst882-fall25'
 dataset_id = 'youtube_raw'
+default_bucket = 'adrineto-ba882-fall25-team-6'
+
+# Raw files of one run: data.json, or part-NNNNN.json windows from chunked extraction
+RAW_FILE = re.compile(r"/(data|part-\d+)\.json$")
+
+# Async mode stages index rows here; job_status loads them once the data loads succeed
+INDEX_STAGING_PREFIX = "raw/youtube/_ingest_index"
+
+def load_index_file(bq_client, uri):
+    """
+    Append staged ingest-index rows (NDJSON) to the index table and wait.
+    """
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition="WRITE_APPEND",
+    )
+    job = bq_client.load_table_from_uri(uri, f"{project_id}.{dataset_id}.{INDEX_TABLE}", job_config=job_config)
+    job.result()
+    print(f"Loaded {job.output_rows} index rows from {uri}")
+    return job
+
+def job_status(bq_client, jobs, tracer=None, index_file=None):
+    """
+    Look up the state of previously submitted BigQuery jobs.
+    Returns "done" when all jobs finished, "failed" if any errored, else "running".
+    Once they stop running, each job's actual load time goes to `tracer`.
+    `index_file` (staged by an async load) is only loaded once every data
+    load is done without errors, so the index never lists records that did
+    not land.
+    """
+    results = []
+    finished = []
+    for ref in jobs:
+        job = bq_client.get_job(ref["job_id"], location=ref.get("location"))
+        if job.state == "DONE":
+            finished.append((ref, job))
+        results.append({
+            **ref,
+            "state": job.state,
+            "error": job.error_result["message"] if job.error_result else None,
+        })
+
+    if any(r["error"] for r in results):
+        status = "failed"
+    elif all(r["state"] == "DONE" for r in results):
+        status = "done"
+    else:
+        status = "running"
+
+    if status == "done" and index_file:
+        try:
+            finished.append(({"table": INDEX_TABLE}, load_index_file(bq_client, index_file)))
+        except Exception as e:
+            # A retried poll loads the file again; duplicate index rows are harmless
+            results.append({"table": INDEX_TABLE, "state": "DONE", "error": str(e)})
+            status = "failed"
+
+    # The sensor stops polling on done/failed, so each job is recorded once
+    if tracer and status != "running":
+        for ref, job in finished:
+            tracer.record_job(f"load_{ref.get('table')}", job, table=ref.get("table"))
+    return {"status": status, "jobs": results}
 
 @functions_framework.http
 def task(request):
@@ -17,60 +81,174 @@ def task(request):
     if request_json is None:
         return {"status": "failed", "error": "Missing payload"}, 400
 
-    bucket_name = request_json["bucket_name"]
-    blob_name = request_json["blob_name"]
-    run_id = request_json["run_id"]
-
-    # Access data from GCS
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
-    data_str = blob.download_as_text()
-    data = json.loads(data_str)
-
-    # Convert JSON to DataFrames
-    videos_df = pd.DataFrame(data.get("videos", []))
-    channels_df = pd.DataFrame(data.get("channels", []))
-    comments_df = pd.DataFrame(data.get("comments", []))
-    video_stats_df = pd.DataFrame(data.get("video_stats", []))
-    categories_df = pd.DataFrame(data.get("categories", []))
-
-    ingest_ts = datetime.utcnow()
-    for df in [videos_df, channels_df, comments_df, video_stats_df, categories_df]:
-        if not df.empty:
-            df["ingest_timestamp"] = ingest_ts
-            df["source_path"] = f"gs://{bucket_name}/{blob_name}"
-            df["run_id"] = run_id
-
-    # Connect to BigQuery
-    bq_client = bigquery.Client(project=project_id)
-
-    def load_table(df, table_name):
-        if df.empty:
-            print(f"Skipping {table_name} (empty DataFrame)")
-            return
+    # Status check for jobs submitted by an earlier async call
+    if "jobs" in request_json and "blob_name" not in request_json and "blob_names" not in request_json:
+        bq_client = bigquery.Client(project=project_id)
+        tracer = Tracer(request_json.get("run_id") or request_json.get("date"), "load",
+                        logical_date_from(request_json.get("date")))
+        try:
+            return job_status(bq_client, request_json["jobs"], tracer, request_json.get("index_file")), 200
+        finally:
+            tracer.flush()
+
+    # In async mode load jobs are submitted and their IDs returned immediately
+    async_jobs = bool(request_json.get("async", False))
+
+    bucket_name = request_json.get("bucket_name", default_bucket)
+    run_id = request_json.get("run_id")
+
+    # Logical date of the DAG run (YYYYMMDD); stamped on every row so transforms
+    # and backfills can work one day at a time
+    date_str = request_json.get("date") or datetime.utcnow().strftime("%Y%m%d")
+    logical_date = datetime.strptime(date_str, "%Y%m%d").date()
+
+    tracer = Tracer(run_id or date_str, "load", logical_date.isoformat())
+    try:
+        # Access data from GCS
+        storage_client = storage.Client()
+        bucket = storage_client.bucket(bucket_name)
+
+        # Backfill reloads every run already extracted for this query and date
+        backfill = bool(request_json.get("backfill", False))
+        if backfill:
+            prefix = f"raw/youtube/query={request_json['query']}/date={date_str}/"
+            blob_names = [b.name for b in bucket.list_blobs(prefix=prefix) if RAW_FILE.search(b.name)]
+            print(f"Backfill {date_str}: found {len(blob_names)} files under {prefix}")
+        else:
+            # Chunked extracts return every part they wrote
+            blob_names = request_json["blob_names"] if "blob_names" in request_json else [request_json["blob_name"]]
+
+        entities = {
+            "videos": "videos",
+            "channels": "channels",
+            "comments": "comments",
+            "video_stats": "video_statistics",
+            "categories": "categories",
+        }
+        frames = {table: [] for table in entities.values()}
+
+        ingest_ts = datetime.utcnow()
+        with tracer.span("read_gcs", files=len(blob_names)) as span:
+            span.add(retries=request_json.get("try_number", 0))
+            for blob_name in blob_names:
+                data_str = bucket.blob(blob_name).download_as_text()
+                span.add(bytes=len(data_str))
+                data = json.loads(data_str)
+                # run folder is the path segment before the file name
+                blob_run_id = run_id if not backfill else blob_name.split("/")[-2]
+
+                # Convert JSON to DataFrames
+                for key, table_name in entities.items():
+                    df = pd.DataFrame(data.get(key, []))
+                    if not df.empty:
+                        df["ingest_timestamp"] = ingest_ts
+                        df["source_path"] = f"gs://{bucket_name}/{blob_name}"
+                        df["run_id"] = blob_run_id
+                        df["logical_date"] = logical_date
+                        frames[table_name].append(df)
+
+        # Connect to BigQuery
+        bq_client = bigquery.Client(project=project_id)
+
+        # Make the backfill idempotent: drop rows previously loaded from these files
+        if backfill and blob_names:
+            source_paths = [f"gs://{bucket_name}/{b}" for b in blob_names]
+            job_config = bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ScalarQueryParameter("d", "DATE", logical_date),
+                bigquery.ArrayQueryParameter("paths", "STRING", source_paths),
+            ])
+            for table_name in entities.values():
+                bq_client.query(
+                    f"DELETE FROM `{project_id}.{dataset_id}.{table_name}` "
+                    f"WHERE logical_date = @d AND source_path IN UNNEST(@paths)",
+                    job_config=job_config,
+                ).result()
+            print(f"Cleared previous loads of {len(source_paths)} files for {date_str}")
+
+        submitted = []
+
+        def load_table(df, table_name):
+            if df.empty:
+                print(f"Skipping {table_name} (empty DataFrame)")
+                return
         
-        for col in ["published_at", "updated_at", "created_at", "collected_at"]:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors="coerce")
-
-        table_id = f"{project_id}.{dataset_id}.{table_name}"
-        job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
-        job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_config)
-        job.result()
-        print(f"Loaded {len(df)} rows into {table_id}")
-
-    # Load each table
-    load_table(videos_df, "videos")
-    load_table(channels_df, "channels")
-    load_table(comments_df, "comments")
-    load_table(video_stats_df, "video_statistics")
-    load_table(categories_df, "categories")
-
-    return {
-        "status": "success",
-        "message": "Data loaded successfully to BigQuery",
-        "project": project_id,
-        "dataset": dataset_id,
-        "run_id": run_id
-    }, 200
+            for col in ["published_at", "updated_at", "created_at", "collected_at"]:
+                if col in df.columns:
+                    df[col] = pd.to_datetime(df[col], errors="coerce")
+
+            table_id = f"{project_id}.{dataset_id}.{table_name}"
+            job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
+            # In async mode this span only times the submission; the load itself
+            # is recorded as load_<table> by job_status once it finishes
+            span_name = f"submit_load_{table_name}" if async_jobs else f"load_{table_name}"
+            with tracer.span(span_name, table=table_name) as span:
+                job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_config)
+                span.add(rows=len(df))
+                if async_jobs:
+                    submitted.append({"job_id": job.job_id, "location": job.location, "table": table_name})
+                    span.set(job_id=job.job_id, async_job=True)
+                    print(f"Submitted load of {len(df)} rows into {table_id} (job {job.job_id})")
+                    return
+                job.result()
+                span.add(bytes=job.output_bytes or 0)
+            print(f"Loaded {len(df)} rows into {table_id}")
+
+        # Skip records already loaded with the same content. Backfills reload
+        # the exact files they just cleared, so they bypass the index.
+        dedup_enabled = bool(request_json.get("dedup", True)) and not backfill
+        index_frames = []
+
+        # Load each table
+        for table_name, dfs in frames.items():
+            df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+            if dedup_enabled and table_name in DEDUP_KEYS and not df.empty:
+                with tracer.span(f"dedup_{table_name}", table=table_name) as span:
+                    total = len(df)
+                    df, index_rows = dedup(bq_client, table_name, df)
+                    if not index_rows.empty:
+                        index_frames.append(index_rows)
+                    span.add(rows=len(df))
+                    span.set(skipped=total - len(df))
+                print(f"{table_name}: {total - len(df)} of {total} records unchanged, skipped")
+            load_table(df, table_name)
+
+        # Index the loaded records only after their data landed, so a failed
+        # data load is retried in full. Sync loads are already done here; in
+        # async mode the rows are staged and job_status loads them once every
+        # data job succeeded.
+        index_file = None
+        if index_frames:
+            index_rows = pd.concat(index_frames, ignore_index=True)
+            if async_jobs:
+                index_rows["ingest_timestamp"] = index_rows["ingest_timestamp"].astype(str)
+                index_rows["logical_date"] = index_rows["logical_date"].astype(str)
+                blob = bucket.blob(f"{INDEX_STAGING_PREFIX}/date={date_str}/{run_id}-{uuid.uuid4().hex[:8]}.jsonl")
+                blob.upload_from_string(index_rows.to_json(orient="records", lines=True), content_type="application/x-ndjson")
+                index_file = f"gs://{bucket_name}/{blob.name}"
+            else:
+                load_table(index_rows, INDEX_TABLE)
+
+        if async_jobs:
+            return {
+                "status": "submitted",
+                "message": "Load jobs submitted to BigQuery",
+                "project": project_id,
+                "dataset": dataset_id,
+                "run_id": run_id,
+                "date": date_str,
+                "jobs": submitted,
+                "index_file": index_file,
+                "trace": tracer.summary()
+            }, 200
+
+        return {
+            "status": "success",
+            "message": "Data loaded successfully to BigQuery",
+            "project": project_id,
+            "dataset": dataset_id,
+            "run_id": run_id,
+            "date": date_str,
+            "trace": tracer.summary()
+        }, 200
+    finally:
+        tracer.flush()
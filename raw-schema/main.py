@@ -1,11 +1,160 @@
 """
 Create BigQuery dataset and tables for YouTube data
 """
+import hashlib
+import json
+import uuid
 import functions_framework
 from google.cloud import bigquery
+from tracing import Tracer, logical_date_from
 
 project_id = 'adrineto-qst882-fall25'
 dataset_id = 'youtube_raw'
+bucket_name = 'adrineto-ba882-fall25-team-6'
+
+# Raw tables are partitioned by the DAG's logical date so a backfill can
+# rewrite one day without touching the others
+partition_field = 'logical_date'
+
+# Tables looked up by key rather than scanned by date
+clustering_fields = {
+    'ingest_index': ['entity', 'key'],
+}
+
+# Define table schemas (any change here changes SCHEMA_VERSION)
+tables_config = {
+    'videos': [
+        bigquery.SchemaField("video_id", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("channel_id", "STRING"),
+        bigquery.SchemaField("title", "STRING"),
+        bigquery.SchemaField("description", "STRING"),
+        bigquery.SchemaField("published_at", "TIMESTAMP"),
+        bigquery.SchemaField("search_query", "STRING"),
+        bigquery.SchemaField("search_order", "STRING"),
+        bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
+        bigquery.SchemaField("source_path", "STRING"),
+        bigquery.SchemaField("run_id", "STRING"),
+        bigquery.SchemaField("logical_date", "DATE"),
+    ],
+    'channels': [
+        bigquery.SchemaField("channel_id", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("channel_title", "STRING"),
+        bigquery.SchemaField("channel_description", "STRING"),
+        bigquery.SchemaField("country", "STRING"),
+        bigquery.SchemaField("published_at", "TIMESTAMP"),
+        bigquery.SchemaField("subscriber_count", "INTEGER"),
+        bigquery.SchemaField("video_count", "INTEGER"),
+        bigquery.SchemaField("view_count", "INTEGER"),
+        bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
+        bigquery.SchemaField("source_path", "STRING"),
+        bigquery.SchemaField("run_id", "STRING"),
+        bigquery.SchemaField("logical_date", "DATE"),
+    ],
+    'comments': [
+        bigquery.SchemaField("comment_id", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("video_id", "STRING"),
+        bigquery.SchemaField("author_display_name", "STRING"),
+        bigquery.SchemaField("text_display", "STRING"),
+        bigquery.SchemaField("like_count", "INTEGER"),
+        bigquery.SchemaField("published_at", "TIMESTAMP"),
+        bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
+        bigquery.SchemaField("source_path", "STRING"),
+        bigquery.SchemaField("run_id", "STRING"),
+        bigquery.SchemaField("logical_date", "DATE"),
+    ],
+    'video_statistics': [
+        bigquery.SchemaField("video_id", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("category_id", "STRING"),
+        bigquery.SchemaField("tags", "STRING"),
+        bigquery.SchemaField("duration", "STRING"),
+        bigquery.SchemaField("view_count", "INTEGER"),
+        bigquery.SchemaField("like_count", "INTEGER"),
+        bigquery.SchemaField("comment_count", "INTEGER"),
+        bigquery.SchemaField("favorite_count", "INTEGER"),
+        bigquery.SchemaField("collected_at", "TIMESTAMP"),
+        bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
+        bigquery.SchemaField("source_path", "STRING"),
+        bigquery.SchemaField("run_id", "STRING"),
+        bigquery.SchemaField("logical_date", "DATE"),
+    ],
+    'categories': [
+        bigquery.SchemaField("category_id", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("category_title", "STRING"),
+        bigquery.SchemaField("assignable", "BOOLEAN"),
+        bigquery.SchemaField("region", "STRING"),
+        bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
+        bigquery.SchemaField("source_path", "STRING"),
+        bigquery.SchemaField("run_id", "STRING"),
+        bigquery.SchemaField("logical_date", "DATE"),
+    ],
+    # Latest content hash per raw record key; raw-parse skips unchanged records
+    'ingest_index': [
+        bigquery.SchemaField("entity", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("key", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("hash", "INTEGER"),
+        bigquery.SchemaField("run_id", "STRING"),
+        bigquery.SchemaField("source_path", "STRING"),
+        bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
+        bigquery.SchemaField("logical_date", "DATE"),
+    ],
+    # One row per traced span, written by every pipeline function (see tracing.py)
+    'pipeline_metrics': [
+        bigquery.SchemaField("run_id", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("stage", "STRING"),
+        bigquery.SchemaField("span", "STRING"),
+        bigquery.SchemaField("status", "STRING"),
+        bigquery.SchemaField("started_at", "TIMESTAMP"),
+        bigquery.SchemaField("duration_ms", "FLOAT"),
+        bigquery.SchemaField("api_units", "INTEGER"),
+        bigquery.SchemaField("rows", "INTEGER"),
+        bigquery.SchemaField("bytes", "INTEGER"),
+        bigquery.SchemaField("retries", "INTEGER"),
+        bigquery.SchemaField("attributes", "STRING"),
+        bigquery.SchemaField("logical_date", "DATE"),
+    ]
+}
+
+# Hive-partitioned external tables (ext_<table>) over the per-entity NDJSON
+# files raw-extract writes with "layout": "entity":
+#   gs://<bucket>/raw/youtube/<table>/query=<q>/date=<yyyymmdd>/<run_id>.jsonl
+# `query` and `date` become STRING partition columns, and every query must
+# filter on them. Columns are the raw table's minus what raw-parse adds.
+external_tables = ['videos', 'channels', 'comments', 'video_statistics', 'categories']
+load_only_columns = {'ingest_timestamp', 'source_path', 'logical_date'}
+
+def external_table(table_name):
+    """
+    Definition of the external table over one entity's files.
+    """
+    uri_prefix = f"gs://{bucket_name}/raw/youtube/{table_name}/"
+    config = bigquery.ExternalConfig("NEWLINE_DELIMITED_JSON")
+    config.source_uris = [f"{uri_prefix}*"]
+    config.ignore_unknown_values = True
+    hive = bigquery.HivePartitioningOptions()
+    hive.mode = "STRINGS"
+    hive.source_uri_prefix = uri_prefix
+    hive.require_partition_filter = True
+    config.hive_partitioning = hive
+
+    schema = [f for f in tables_config[table_name] if f.name not in load_only_columns]
+    table = bigquery.Table(f"{project_id}.{dataset_id}.ext_{table_name}", schema=schema)
+    table.external_data_configuration = config
+    return table
+
+def schema_version(config):
+    """
+    Short hash of the table definitions; stored as a dataset label so the DAG
+    can skip schema setup when the deployed definitions are already applied.
+    """
+    spec = {
+        table: [(f.name, f.field_type, f.mode) for f in fields]
+        for table, fields in sorted(config.items())
+    }
+    spec['_external'] = external_tables
+    return hashlib.sha256(json.dumps(spec).encode()).hexdigest()[:16]
+
+SCHEMA_VERSION = schema_version(tables_config)
+
 
 @functions_framework.http
 def task(request):
@@ -16,125 +165,119 @@ def task(request):
         # Get request parameters
         request_json = request.get_json(silent=True)
         drop_existing = False
+        check_only = False
         
         if request_json:
             drop_existing = request_json.get('drop_existing', False)
+            check_only = request_json.get('check_only', False)
         
         if request.args:
             drop_existing = request.args.get('drop_existing', 'false').lower() == 'true'
         
-        print(f"Setting up BigQuery schema (drop_existing={drop_existing})")
-        
         # Initialize BigQuery client
         client = bigquery.Client(project=project_id)
         
-        # Create dataset if not exists
-        dataset_ref = f"{project_id}.{dataset_id}"
-        try:
-            dataset = bigquery.Dataset(dataset_ref)
-            dataset.location = "us-central1"
-            dataset = client.create_dataset(dataset, exists_ok=True)
-            print(f"Dataset {dataset_id} ready")
-        except Exception as e:
-            print(f"Dataset already exists or error: {e}")
+        request_json = request_json or {}
+        tracer = Tracer(request_json.get("run_id") or uuid.uuid4().hex[:12], "schema",
+                        logical_date_from(request_json.get("date")))
         
-        # Define table schemas
-        tables_config = {
-            'videos': [
-                bigquery.SchemaField("video_id", "STRING", mode="REQUIRED"),
-                bigquery.SchemaField("channel_id", "STRING"),
-                bigquery.SchemaField("title", "STRING"),
-                bigquery.SchemaField("description", "STRING"),
-                bigquery.SchemaField("published_at", "TIMESTAMP"),
-                bigquery.SchemaField("search_query", "STRING"),
-                bigquery.SchemaField("search_order", "STRING"),
-                bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
-                bigquery.SchemaField("source_path", "STRING"),
-                bigquery.SchemaField("run_id", "STRING"),
-            ],
-            'channels': [
-                bigquery.SchemaField("channel_id", "STRING", mode="REQUIRED"),
-                bigquery.SchemaField("channel_title", "STRING"),
-                bigquery.SchemaField("channel_description", "STRING"),
-                bigquery.SchemaField("country", "STRING"),
-                bigquery.SchemaField("published_at", "TIMESTAMP"),
-                bigquery.SchemaField("subscriber_count", "INTEGER"),
-                bigquery.SchemaField("video_count", "INTEGER"),
-                bigquery.SchemaField("view_count", "INTEGER"),
-                bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
-                bigquery.SchemaField("source_path", "STRING"),
-                bigquery.SchemaField("run_id", "STRING"),
-            ],
-            'comments': [
-                bigquery.SchemaField("comment_id", "STRING", mode="REQUIRED"),
-                bigquery.SchemaField("video_id", "STRING"),
-                bigquery.SchemaField("author_display_name", "STRING"),
-                bigquery.SchemaField("text_display", "STRING"),
-                bigquery.SchemaField("like_count", "INTEGER"),
-                bigquery.SchemaField("published_at", "TIMESTAMP"),
-                bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
-                bigquery.SchemaField("source_path", "STRING"),
-                bigquery.SchemaField("run_id", "STRING"),
-            ],
-            'video_statistics': [
-                bigquery.SchemaField("video_id", "STRING", mode="REQUIRED"),
-                bigquery.SchemaField("category_id", "STRING"),
-                bigquery.SchemaField("tags", "STRING"),
-                bigquery.SchemaField("duration", "STRING"),
-                bigquery.SchemaField("view_count", "INTEGER"),
-                bigquery.SchemaField("like_count", "INTEGER"),
-                bigquery.SchemaField("comment_count", "INTEGER"),
-                bigquery.SchemaField("favorite_count", "INTEGER"),
-                bigquery.SchemaField("collected_at", "TIMESTAMP"),
-                bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
-                bigquery.SchemaField("source_path", "STRING"),
-                bigquery.SchemaField("run_id", "STRING"),
-            ],
-            'categories': [
-                bigquery.SchemaField("category_id", "STRING", mode="REQUIRED"),
-                bigquery.SchemaField("category_title", "STRING"),
-                bigquery.SchemaField("assignable", "BOOLEAN"),
-                bigquery.SchemaField("region", "STRING"),
-                bigquery.SchemaField("ingest_timestamp", "TIMESTAMP"),
-                bigquery.SchemaField("source_path", "STRING"),
-                bigquery.SchemaField("run_id", "STRING"),
-            ]
-        }
+        # Cheap check: compare the deployed schema version to the dataset label
+        if check_only and not drop_existing:
+            with tracer.span("check_version") as span:
+                span.add(retries=request_json.get("try_number", 0))
+                try:
+                    stored_version = client.get_dataset(f"{project_id}.{dataset_id}").labels.get("schema_version")
+                except Exception as e:
+                    print(f"Could not read dataset labels: {e}")
+                    stored_version = None
+                span.set(stored_version=stored_version, schema_version=SCHEMA_VERSION)
+            tracer.flush()
+            print(f"Schema version stored={stored_version} deployed={SCHEMA_VERSION}")
+            return {
+                "status": "success",
+                "schema_version": SCHEMA_VERSION,
+                "stored_version": stored_version,
+                "up_to_date": stored_version == SCHEMA_VERSION
+            }, 200
+        
+        print(f"Setting up BigQuery schema (drop_existing={drop_existing})")
         
-        # Create or recreate tables
-        tables_info = []
-        for table_name, schema in tables_config.items():
-            table_ref = f"{project_id}.{dataset_id}.{table_name}"
+        with tracer.span("setup_tables", drop_existing=drop_existing) as span:
+            span.add(retries=request_json.get("try_number", 0))
+            # Create dataset if not exists
+            dataset_ref = f"{project_id}.{dataset_id}"
+            try:
+                dataset = bigquery.Dataset(dataset_ref)
+                dataset.location = "us-central1"
+                dataset = client.create_dataset(dataset, exists_ok=True)
+                print(f"Dataset {dataset_id} ready")
+            except Exception as e:
+                print(f"Dataset already exists or error: {e}")
+        
+            # Create or recreate tables
+            tables_info = []
+            for table_name, schema in tables_config.items():
+                table_ref = f"{project_id}.{dataset_id}.{table_name}"
             
-            # Drop if requested
-            if drop_existing:
-                try:
-                    client.delete_table(table_ref)
-                    print(f"Dropped table {table_name}")
-                except Exception:
-                    pass
+                # Drop if requested
+                if drop_existing:
+                    try:
+                        client.delete_table(table_ref)
+                        print(f"Dropped table {table_name}")
+                    except Exception:
+                        pass
             
-            # Create table
-            table = bigquery.Table(table_ref, schema=schema)
-            try:
-                table = client.create_table(table, exists_ok=True)
-                print(f"Table {table_name} ready")
+                # Create table
+                table = bigquery.Table(table_ref, schema=schema)
+                table.time_partitioning = bigquery.TimePartitioning(field=partition_field)
+                table.clustering_fields = clustering_fields.get(table_name)
+                try:
+                    table = client.create_table(table, exists_ok=True)
                 
-                # Get row count
-                query = f"SELECT COUNT(*) as cnt FROM `{table_ref}`"
-                result = client.query(query).result()
-                row_count = next(result).cnt
+                    # Add columns introduced since the table was created
+                    existing = {f.name for f in table.schema}
+                    missing = [f for f in schema if f.name not in existing]
+                    if missing:
+                        table.schema = list(table.schema) + missing
+                        table = client.update_table(table, ["schema"])
+                        print(f"Added columns to {table_name}: {[f.name for f in missing]}")
                 
-                tables_info.append({
-                    "table": table_name,
-                    "row_count": row_count
-                })
-            except Exception as e:
-                print(f"Error creating table {table_name}: {e}")
-                tables_info.append({
-                    "table": table_name,
-                    "error": str(e)
-                })
+                    print(f"Table {table_name} ready")
+                
+                    # Row count from table metadata (no query, no bytes scanned)
+                    tables_info.append({
+                        "table": table_name,
+                        "row_count": table.num_rows
+                    })
+                except Exception as e:
+                    print(f"Error creating table {table_name}: {e}")
+                    tables_info.append({
+                        "table": table_name,
+                        "error": str(e)
+                    })
+
+            # External tables hold no data, so they are simply recreated
+            for table_name in external_tables:
+                table = external_table(table_name)
+                try:
+                    client.delete_table(table.reference, not_found_ok=True)
+                    client.create_table(table)
+                    print(f"External table ext_{table_name} ready")
+                    tables_info.append({"table": f"ext_{table_name}", "external": True})
+                except Exception as e:
+                    print(f"Error creating external table ext_{table_name}: {e}")
+                    tables_info.append({
+                        "table": f"ext_{table_name}",
+                        "error": str(e)
+                    })
+        
+            # Record the applied version only if every table is in place
+            if not any("error" in t for t in tables_info):
+                dataset = client.get_dataset(dataset_ref)
+                dataset.labels = {**(dataset.labels or {}), "schema_version": SCHEMA_VERSION}
+                client.update_dataset(dataset, ["labels"])
+            span.add(rows=sum(t.get("row_count") or 0 for t in tables_info))
+        tracer.flush()
         
         print("Schema setup complete")
         
@@ -144,6 +287,7 @@ def task(request):
             "project": project_id,
             "dataset": dataset_id,
             "tables": tables_info,
+            "schema_version": SCHEMA_VERSION,
             "drop_existing": drop_existing
         }, 200
         
@@ -0,0 +1,173 @@
+"""
+Run tracing for the pipeline functions.
+
+Each function opens a Tracer for its stage, wraps the expensive steps in
+spans and records counters (API units, rows, bytes, retries) on them. Spans
+are keyed by the DAG's run_id so one run can be followed from schema to
+transform in youtube_raw.pipeline_metrics.
+
+Set TRACE_EXPORTER to choose where spans go:
+  bigquery (default)   stream into the metrics table
+  file:/path/to.jsonl  append JSON lines locally (tests / local runs)
+  none                 drop them
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+project_id = 'adrineto-qst882-fall25'
+metrics_table = f"{project_id}.youtube_raw.pipeline_metrics"
+
+COUNTERS = ("api_units", "rows", "bytes", "retries")
+
+
+class Span:
+    """
+    One timed step of a stage, with additive counters.
+    """
+
+    def __init__(self, tracer, name, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started_at = datetime.now(timezone.utc)
+        self.duration_ms = None
+        self.status = "ok"
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + (value or 0)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_row(self):
+        return {
+            "run_id": self.tracer.run_id,
+            "stage": self.tracer.stage,
+            "span": self.name,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            **{k: self.counters.get(k, 0) for k in COUNTERS},
+            "attributes": json.dumps(self.attributes, default=str),
+            "logical_date": self.tracer.logical_date,
+        }
+
+
+class Tracer:
+    """
+    Collects the spans of one stage of one run and exports them on flush().
+    """
+
+    def __init__(self, run_id, stage, logical_date=None, exporter=None):
+        self.run_id = run_id
+        self.stage = stage
+        self.logical_date = logical_date
+        self.exporter = exporter or get_exporter()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(self, name, attributes)
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.status = "error"
+            span.set(error=str(e))
+            raise
+        finally:
+            span.duration_ms = round((time.perf_counter() - start) * 1000, 1)
+            self.spans.append(span)
+
+    def record_job(self, name, job, **attributes):
+        """
+        Span for a BigQuery job that ran after the request that submitted it
+        returned (async mode): timed from the job's own start/end, with its
+        rows, bytes and slot-ms. Call once the job is done.
+        """
+        span = Span(self, name, attributes)
+        span.started_at = job.started or job.created or span.started_at
+        ended = job.ended or datetime.now(timezone.utc)
+        span.duration_ms = round((ended - span.started_at).total_seconds() * 1000, 1)
+        # Load jobs report output rows/bytes, query jobs DML rows and bytes scanned
+        span.add(
+            rows=getattr(job, "output_rows", None) or getattr(job, "num_dml_affected_rows", None),
+            bytes=getattr(job, "output_bytes", None) or getattr(job, "total_bytes_processed", None),
+        )
+        span.set(job_id=job.job_id, slot_ms=getattr(job, "slot_millis", None), async_job=True)
+        if job.error_result:
+            span.status = "error"
+            span.set(error=job.error_result.get("message"))
+        self.spans.append(span)
+        return span
+
+    def summary(self):
+        """
+        Compact per-span view for the function's HTTP response.
+        """
+        return [
+            {"span": s.name, "duration_ms": s.duration_ms, **{k: v for k, v in s.counters.items() if v}}
+            for s in self.spans
+        ]
+
+    def flush(self):
+        rows = [s.to_row() for s in self.spans]
+        self.spans = []
+        if not rows:
+            return
+        try:
+            self.exporter.export(rows)
+        except Exception as e:
+            # Telemetry must never fail the pipeline
+            print(f"Trace export failed: {e}")
+
+
+class BigQueryExporter:
+    def __init__(self, table_id=metrics_table):
+        self.table_id = table_id
+
+    def export(self, rows):
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=project_id)
+        errors = client.insert_rows_json(self.table_id, rows)
+        if errors:
+            print(f"Trace insert errors: {errors}")
+
+
+class FileExporter:
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, rows):
+        with open(self.path, "a") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=str) + "\n")
+
+
+class NullExporter:
+    def export(self, rows):
+        pass
+
+
+def get_exporter():
+    setting = os.getenv("TRACE_EXPORTER", "bigquery")
+    if setting.startswith("file:"):
+        return FileExporter(setting[len("file:"):])
+    if setting == "none":
+        return NullExporter()
+    return BigQueryExporter()
+
+
+def logical_date_from(date_str):
+    """
+    Convert the DAG's YYYYMMDD date to the ISO date stored on metric rows.
+    """
+    if not date_str:
+        return datetime.now(timezone.utc).date().isoformat()
+    return datetime.strptime(date_str, "%Y%m%d").date().isoformat()
@@ -1,17 +1,169 @@
 """
 Transform raw data into staging tables for YouTube data with incremental merge logic and deduplication.
 """
+import re
+import time
 import functions_framework
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
 from flask import jsonify
+from datetime import datetime
+from tracing import Tracer, logical_date_from
 
 project_id = 'adrineto-qst882-fall25'
 dataset_id = 'youtube_staging'
 location = 'us-central1'
 
+# Tracked-video retirement rules: stop refreshing videos older than
+# TRACKING_MAX_AGE_DAYS, or whose views did not change for TRACKING_STALE_DAYS
+TRACKING_MAX_AGE_DAYS = 180
+TRACKING_STALE_DAYS = 14
+
+# Raw tables the MERGEs read; with "source": "external" they are read from the
+# hive-partitioned ext_<table> tables over GCS instead (no raw-parse load)
+RAW_TABLES = ["videos", "channels", "comments", "video_statistics"]
+RAW_SOURCES = ("native", "external")
+
+# BigQuery aborts a MERGE that overlaps other DML on the same table; an
+# aborted statement changed nothing, so it is simply run again
+SERIALIZATION_ERROR = "Could not serialize access"
+DML_RETRIES = 3
+DML_RETRY_DELAY = 15  # seconds, doubled per attempt
+
+def run_dml(client, query, job_config):
+    """
+    Run one DML statement to completion, retrying concurrent-update aborts.
+    """
+    for attempt in range(DML_RETRIES + 1):
+        job = client.query(query, job_config=job_config)
+        try:
+            job.result()
+            return job, attempt
+        except Exception as e:
+            if SERIALIZATION_ERROR not in str(e) or attempt == DML_RETRIES:
+                raise
+            print(f"Concurrent update on job {job.job_id}; retrying ({attempt + 1}/{DML_RETRIES})")
+            time.sleep(DML_RETRY_DELAY * 2 ** attempt)
+
+def ensure_partitioned(client, table_id, field):
+    """
+    Migrate a table created before it was partitioned: copy it into a
+    partitioned table, drop the original and rename the copy into its place.
+    BigQuery can't change a table's partitioning in place. If an earlier
+    attempt stopped after the drop, the copy is simply renamed.
+    """
+    copy_id = f"{table_id}__partitioned"
+    try:
+        table = client.get_table(table_id)
+    except NotFound:
+        table = None
+    if table is not None:
+        if table.time_partitioning and table.time_partitioning.field == field:
+            return
+        print(f"Partitioning {table_id} by {field}")
+        client.query(
+            f"CREATE OR REPLACE TABLE `{copy_id}` PARTITION BY {field} AS SELECT * FROM `{table_id}`"
+        ).result()
+        client.delete_table(table_id)
+    try:
+        client.get_table(copy_id)
+    except NotFound:
+        return  # nothing to migrate; step 1 creates the table
+    client.query(f"ALTER TABLE `{copy_id}` RENAME TO `{table_id.split('.')[-1]}`").result()
+    print(f"Migrated {table_id} to a table partitioned by {field}")
+
+# Target of a script statement, to name its span like the sync path's merge_<table>
+MERGE_TARGET = re.compile(r"(?:MERGE|UPDATE)\s+(?:INTO\s+)?`?([\w.-]+)`?", re.IGNORECASE)
+
+def record_script(client, job, tracer):
+    """
+    One span per statement of a finished transformation script, timed and
+    counted from the statement's child job.
+    """
+    try:
+        children = list(client.list_jobs(parent_job=job.job_id))
+    except Exception as e:
+        print(f"Could not list statements of {job.job_id}: {e}")
+        children = []
+    if not children:
+        tracer.record_job("merge_script", job)
+        return
+    for child in children:
+        match = MERGE_TARGET.search(getattr(child, "query", None) or "")
+        name = match.group(1).split(".")[-1] if match else child.job_id
+        tracer.record_job(f"merge_{name}", child, table=name, script_job_id=job.job_id)
+
+def job_status(client, jobs, tracer=None):
+    """
+    Look up the state of previously submitted BigQuery jobs.
+    Returns "done" when all jobs finished, "failed" if any errored, else "running".
+    Once they stop running, each statement's actual run time goes to `tracer`.
+    """
+    results = []
+    finished = []
+    for ref in jobs:
+        job = client.get_job(ref["job_id"], location=ref.get("location", location))
+        if job.state == "DONE":
+            finished.append(job)
+        results.append({
+            **ref,
+            "state": job.state,
+            "error": job.error_result["message"] if job.error_result else None,
+        })
+
+    if any(r["error"] for r in results):
+        status = "failed"
+    elif all(r["state"] == "DONE" for r in results):
+        status = "done"
+    else:
+        status = "running"
+
+    # The sensor stops polling on done/failed, so each job is recorded once
+    if tracer and status != "running":
+        for job in finished:
+            record_script(client, job, tracer)
+    return {"status": status, "jobs": results}
+
 @functions_framework.http
 def task(request):
     client = bigquery.Client(project=project_id, location=location)
+    request_json = request.get_json(silent=True) or {}
+
+    # Status check for a job submitted by an earlier async call
+    if request_json.get("jobs"):
+        tracer = Tracer(request_json.get("run_id") or request_json.get("date"), "transform",
+                        logical_date_from(request_json.get("date")))
+        try:
+            return jsonify(job_status(client, request_json["jobs"], tracer))
+        finally:
+            tracer.flush()
+
+    # In async mode the MERGEs are submitted as one script job and its ID returned immediately.
+    # Manual use only: the DAGs call synchronously so the bigquery_dml pool
+    # slot is held until the MERGEs commit
+    async_jobs = bool(request_json.get("async", False))
+
+    # Logical date (YYYYMMDD) of the DAG run; every MERGE reads and writes only this day
+    date_str = request_json.get("date") or datetime.utcnow().strftime("%Y%m%d")
+    run_date = datetime.strptime(date_str, "%Y%m%d").date()
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("run_date", "DATE", run_date),
+        bigquery.ScalarQueryParameter("run_date_key", "STRING", date_str),
+    ])
+
+    source = request_json.get("source", "native")
+    if source not in RAW_SOURCES:
+        return jsonify({"status": "failed", "error": f"Unknown source: {source}"}), 400
+    raw_dataset = f"{project_id}.youtube_raw"
+    if source == "external":
+        # Prune to the run's date= partition; logical_date is derived so the
+        # MERGEs below read both sources the same way
+        raw = {
+            t: f"(SELECT *, PARSE_DATE('%Y%m%d', date) AS logical_date FROM `{raw_dataset}.ext_{t}` WHERE date = @run_date_key)"
+            for t in RAW_TABLES
+        }
+    else:
+        raw = {t: f"`{raw_dataset}.{t}`" for t in RAW_TABLES}
 
     # Define staging table schemas
     table_schemas = {
@@ -21,19 +173,22 @@ def task(request):
             bigquery.SchemaField("description", "STRING"),
             bigquery.SchemaField("channel_id", "STRING"),
             bigquery.SchemaField("published_at", "TIMESTAMP"),
-            bigquery.SchemaField("last_updated", "TIMESTAMP")
+            bigquery.SchemaField("last_updated", "TIMESTAMP"),
+            bigquery.SchemaField("source_date", "DATE")
         ],
         "dim_channels": [
             bigquery.SchemaField("channel_id", "STRING", mode="REQUIRED"),
             bigquery.SchemaField("channel_title", "STRING"),
             bigquery.SchemaField("channel_description", "STRING"),
-            bigquery.SchemaField("last_updated", "TIMESTAMP")
+            bigquery.SchemaField("last_updated", "TIMESTAMP"),
+            bigquery.SchemaField("source_date", "DATE")
         ],
         "dim_comments": [
             bigquery.SchemaField("comment_id", "STRING", mode="REQUIRED"),
             bigquery.SchemaField("author_display_name", "STRING"),
             bigquery.SchemaField("comment_text", "STRING"),
-            bigquery.SchemaField("last_updated", "TIMESTAMP")
+            bigquery.SchemaField("last_updated", "TIMESTAMP"),
+            bigquery.SchemaField("source_date", "DATE")
         ],
         "fact_video_statistics": [
             bigquery.SchemaField("video_id", "STRING", mode="REQUIRED"),
@@ -50,24 +205,49 @@ def task(request):
             bigquery.SchemaField("like_count", "INTEGER"),
             bigquery.SchemaField("published_at", "TIMESTAMP")
         ],
+        # Registry of videos whose statistics are refreshed daily, even after
+        # they drop out of the search results
+        "tracked_videos": [
+            bigquery.SchemaField("video_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("published_at", "TIMESTAMP"),
+            bigquery.SchemaField("tracked_since", "TIMESTAMP"),
+            bigquery.SchemaField("retired_at", "TIMESTAMP"),
+            bigquery.SchemaField("retire_reason", "STRING")
+        ],
     }
 
-    # --- Step 1: Ensure all tables exist ---
+    # Fact tables are partitioned by date so each run only rewrites its own day
+    table_partitioning = {
+        "fact_video_statistics": "date",
+    }
+
+    # --- Step 1: Ensure all tables exist, with their current columns and partitioning ---
     for table_name, schema in table_schemas.items():
         table_id = f"{project_id}.{dataset_id}.{table_name}"
+        if table_name in table_partitioning:
+            ensure_partitioned(client, table_id, table_partitioning[table_name])
         try:
-            client.get_table(table_id)
+            table = client.get_table(table_id)
             print(f"Table already exists: {table_id}")
-        except Exception:
+        except NotFound:
             table = bigquery.Table(table_id, schema=schema)
+            if table_name in table_partitioning:
+                table.time_partitioning = bigquery.TimePartitioning(field=table_partitioning[table_name])
             client.create_table(table)
             print(f"Created table: {table_id}")
+            continue
+        existing = {f.name for f in table.schema}
+        missing = [f for f in schema if f.name not in existing]
+        if missing:
+            table.schema = list(table.schema) + missing
+            client.update_table(table, ["schema"])
+            print(f"Added columns to {table_name}: {[f.name for f in missing]}")
 
     # --- Step 2: Run transformations with deduplication ---
-    queries = [
+    # Keyed by target table, in execution order (dims before the facts that use them)
+    queries = {
 
-    # DIM_VIDEOS
-    """
+    "dim_videos": f"""
     MERGE `adrineto-qst882-fall25.youtube_staging.dim_videos` AS T
     USING (
       SELECT
@@ -76,68 +256,72 @@ def task(request):
         ANY_VALUE(description) AS description,
         ANY_VALUE(channel_id) AS channel_id,
         ANY_VALUE(published_at) AS published_at
-      FROM `adrineto-qst882-fall25.youtube_raw.videos`
+      FROM {raw['videos']}
+      WHERE logical_date = @run_date
       GROUP BY video_id
     ) AS S
     ON T.video_id = S.video_id
-    WHEN MATCHED THEN
+    -- A backfill of an older date must not overwrite newer attributes
+    WHEN MATCHED AND (T.source_date IS NULL OR T.source_date <= @run_date) THEN
       UPDATE SET
         T.title = S.title,
         T.description = S.description,
         T.channel_id = S.channel_id,
         T.published_at = S.published_at,
-        T.last_updated = CURRENT_TIMESTAMP()
+        T.last_updated = CURRENT_TIMESTAMP(),
+        T.source_date = @run_date
     WHEN NOT MATCHED THEN
-      INSERT (video_id, title, description, channel_id, published_at, last_updated)
-      VALUES (S.video_id, S.title, S.description, S.channel_id, S.published_at, CURRENT_TIMESTAMP());
+      INSERT (video_id, title, description, channel_id, published_at, last_updated, source_date)
+      VALUES (S.video_id, S.title, S.description, S.channel_id, S.published_at, CURRENT_TIMESTAMP(), @run_date);
     """,
 
-    # DIM_CHANNELS
-    """
+    "dim_channels": f"""
     MERGE `adrineto-qst882-fall25.youtube_staging.dim_channels` AS T
     USING (
       SELECT
         channel_id,
         ANY_VALUE(channel_title) AS channel_title,
         ANY_VALUE(channel_description) AS channel_description
-      FROM `adrineto-qst882-fall25.youtube_raw.channels`
+      FROM {raw['channels']}
+      WHERE logical_date = @run_date
       GROUP BY channel_id
     ) AS S
     ON T.channel_id = S.channel_id
-    WHEN MATCHED THEN
+    WHEN MATCHED AND (T.source_date IS NULL OR T.source_date <= @run_date) THEN
       UPDATE SET
         T.channel_title = S.channel_title,
         T.channel_description = S.channel_description,
-        T.last_updated = CURRENT_TIMESTAMP()
+        T.last_updated = CURRENT_TIMESTAMP(),
+        T.source_date = @run_date
     WHEN NOT MATCHED THEN
-      INSERT (channel_id, channel_title, channel_description, last_updated)
-      VALUES (S.channel_id, S.channel_title, S.channel_description, CURRENT_TIMESTAMP());
+      INSERT (channel_id, channel_title, channel_description, last_updated, source_date)
+      VALUES (S.channel_id, S.channel_title, S.channel_description, CURRENT_TIMESTAMP(), @run_date);
     """,
 
-    # DIM_COMMENTS
-    """
+    "dim_comments": f"""
     MERGE `adrineto-qst882-fall25.youtube_staging.dim_comments` AS T
     USING (
       SELECT
         comment_id,
         ANY_VALUE(author_display_name) AS author_display_name,
         ANY_VALUE(text_display) AS comment_text
-      FROM `adrineto-qst882-fall25.youtube_raw.comments`
+      FROM {raw['comments']}
+      WHERE logical_date = @run_date
       GROUP BY comment_id
     ) AS S
     ON T.comment_id = S.comment_id
-    WHEN MATCHED THEN
+    WHEN MATCHED AND (T.source_date IS NULL OR T.source_date <= @run_date) THEN
       UPDATE SET
         T.author_display_name = S.author_display_name,
         T.comment_text = S.comment_text,
-        T.last_updated = CURRENT_TIMESTAMP()
+        T.last_updated = CURRENT_TIMESTAMP(),
+        T.source_date = @run_date
     WHEN NOT MATCHED THEN
-      INSERT (comment_id, author_display_name, comment_text, last_updated)
-      VALUES (S.comment_id, S.author_display_name, S.comment_text, CURRENT_TIMESTAMP());
+      INSERT (comment_id, author_display_name, comment_text, last_updated, source_date)
+      VALUES (S.comment_id, S.author_display_name, S.comment_text, CURRENT_TIMESTAMP(), @run_date);
     """,
 
-    # FACT_VIDEO_STATISTICS
-    """
+    "fact_video_statistics": f"""
     MERGE `adrineto-qst882-fall25.youtube_staging.fact_video_statistics` AS T
     USING (
       SELECT
@@ -180,16 +364,19 @@ def task(request):
             ELSE NULL
             END
         ) AS duration,
-        CURRENT_DATE() AS date,
+        @run_date AS date,
         MAX(s.view_count) AS view_count,
         MAX(s.like_count) AS like_count,
         MAX(s.comment_count) AS comment_count
-      FROM `adrineto-qst882-fall25.youtube_raw.video_statistics` s
-      JOIN `adrineto-qst882-fall25.youtube_raw.videos` v
+      FROM {raw['video_statistics']} s
+      -- dim_videos (merged above) also covers videos refreshed outside today's search
+      JOIN `adrineto-qst882-fall25.youtube_staging.dim_videos` v
         ON s.video_id = v.video_id
+      WHERE s.logical_date = @run_date
       GROUP BY v.video_id
     ) AS S
-    ON T.video_id = S.video_id AND T.date = S.date
+    -- T.date = @run_date limits the MERGE to this run's partition
+    ON T.video_id = S.video_id AND T.date = S.date AND T.date = @run_date
     WHEN MATCHED THEN
       UPDATE SET
         T.view_count = S.view_count,
@@ -201,8 +388,7 @@ def task(request):
       VALUES (S.video_id, S.channel_id, S.duration, S.date, S.view_count, S.like_count, S.comment_count);
     """,
 
-    # FACT_COMMENTS
-    """
+    "fact_comments": f"""
     MERGE `adrineto-qst882-fall25.youtube_staging.fact_comments` AS T
     USING (
       SELECT
@@ -210,7 +396,8 @@ def task(request):
         ANY_VALUE(video_id) AS video_id,
         MAX(like_count) AS like_count,
         ANY_VALUE(published_at) AS published_at
-      FROM `adrineto-qst882-fall25.youtube_raw.comments`
+      FROM {raw['comments']}
+      WHERE logical_date = @run_date
       GROUP BY comment_id
     ) AS S
     ON T.comment_id = S.comment_id
@@ -222,17 +409,85 @@ def task(request):
     WHEN NOT MATCHED THEN
       INSERT (comment_id, video_id, like_count, published_at)
       VALUES (S.comment_id, S.video_id, S.like_count, S.published_at);
+    """,
+
+    "tracked_videos": f"""
+    -- Start tracking new videos that are still young enough to be worth it
+    MERGE `adrineto-qst882-fall25.youtube_staging.tracked_videos` AS T
+    USING (
+      SELECT video_id, published_at
+      FROM `adrineto-qst882-fall25.youtube_staging.dim_videos`
+      WHERE published_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {TRACKING_MAX_AGE_DAYS} DAY)
+    ) AS S
+    ON T.video_id = S.video_id
+    WHEN NOT MATCHED THEN
+      INSERT (video_id, published_at, tracked_since)
+      VALUES (S.video_id, S.published_at, CURRENT_TIMESTAMP());
+
+    -- Retire videos that are too old or whose views stopped moving
+    UPDATE `adrineto-qst882-fall25.youtube_staging.tracked_videos` AS T
+    SET
+      retired_at = CURRENT_TIMESTAMP(),
+      retire_reason = IF(
+        T.published_at < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {TRACKING_MAX_AGE_DAYS} DAY),
+        'max_age', 'no_growth')
+    WHERE T.retired_at IS NULL
+      AND (
+        T.published_at < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {TRACKING_MAX_AGE_DAYS} DAY)
+        OR T.video_id IN (
+          SELECT video_id
+          FROM `adrineto-qst882-fall25.youtube_staging.fact_video_statistics`
+          WHERE date > DATE_SUB(@run_date, INTERVAL {TRACKING_STALE_DAYS} DAY)
+            AND date <= @run_date
+          GROUP BY video_id
+          HAVING COUNT(*) >= {TRACKING_STALE_DAYS} AND MAX(view_count) = MIN(view_count)
+        )
+      );
     """
-    ]
+    }
 
-    results = []
-    for i, query in enumerate(queries):
-        job = client.query(query)
-        job.result()
-        results.append(f"Query {i+1} executed successfully")
-
-    return jsonify({
-        "status": "success",
-        "message": "Incremental transformations with deduplication completed successfully",
-        "results": results
-    })
+    # Optional subset of target tables (e.g. stats-only refreshes)
+    tables = request_json.get("tables")
+    if tables:
+        unknown = set(tables) - set(queries)
+        if unknown:
+            return jsonify({"status": "failed", "error": f"Unknown tables: {sorted(unknown)}"}), 400
+        queries = {name: sql for name, sql in queries.items() if name in tables}
+
+    run_id = request_json.get("run_id") or date_str
+    tracer = Tracer(run_id, "transform", run_date.isoformat())
+    try:
+        if async_jobs:
+            # A multi-statement script keeps the MERGEs ordered without holding this request open
+            with tracer.span("submit_script", queries=len(queries)) as span:
+                span.add(retries=request_json.get("try_number", 0))
+                job = client.query("\n".join(queries.values()), job_config=job_config)
+                span.set(job_id=job.job_id, async_job=True)
+            print(f"Submitted transformation script (job {job.job_id})")
+            return jsonify({
+                "status": "submitted",
+                "message": "Incremental transformations submitted to BigQuery",
+                "date": date_str,
+                "jobs": [{"job_id": job.job_id, "location": job.location, "table": "youtube_staging"}],
+                "trace": tracer.summary()
+            })
+
+        results = []
+        for i, (name, query) in enumerate(queries.items()):
+            with tracer.span(f"merge_{name}", table=name) as span:
+                job, dml_retries = run_dml(client, query, job_config)
+                span.add(rows=job.num_dml_affected_rows or 0, bytes=job.total_bytes_processed or 0, retries=dml_retries)
+                span.set(job_id=job.job_id, slot_ms=job.slot_millis)
+                if i == 0:
+                    span.add(retries=request_json.get("try_number", 0))
+            results.append(f"{name} merged successfully")
+
+        return jsonify({
+            "status": "success",
+            "message": "Incremental transformations with deduplication completed successfully",
+            "date": date_str,
+            "results": results,
+            "trace": tracer.summary()
+        })
+    finally:
+        tracer.flush()
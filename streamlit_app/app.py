@@ -1,12 +1,14 @@
 import streamlit as st
 import pandas as pd
-from utils.bq import run_query
+from utils.bq import run_query, run_time_series
+from utils.budget import fit_window
 
 st.set_page_config(page_title="YouTube Data Dashboard", layout="wide")
 st.title("YouTube Data Dashboard")
 
 PROJECT = st.secrets.get("gcp_project_id") or st.secrets["gcp_service_account"]["project_id"]
 DATASET  = st.secrets.get("bq_dataset", "youtube_staging")
+MAX_DAYS = 30  # longest date range offered; the cached base frame covers it
 
 # ---------------- Sidebar filters ----------------
 with st.sidebar:
@@ -29,9 +31,9 @@ with st.sidebar:
         channel_options = ["(All)"] + list(channel_map.keys())
         channel = st.selectbox("Channel", channel_options, index=0)
 
-# WHERE uses s.date; channel filter via c.channel_id
-where = "WHERE s.date >= DATE_SUB(CURRENT_DATE(), INTERVAL @ndays DAY)"
-params = {"ndays": str(ndays)}
+# WHERE uses s.date (@since is bound by run_time_series); channel filter via c.channel_id
+where = "WHERE s.date >= @since"
+params = {}
 if channel != "(All)":
     where += " AND c.channel_id = @channel_id"
     params["channel_id"] = channel_map[channel]
@@ -46,12 +48,20 @@ if channel != "(All)":
 #     st.success("✅ Connected to BigQuery successfully!")
 #     st.dataframe(ok)
 
-# ---------------- KPIs ----------------
-kpis_sql = f"""
+# ---------------- One scan per filter change ----------------
+# Every panel below reads the same filtered join, so fetch it once and
+# derive the KPIs, series and top-N tables in pandas. The frame is kept per
+# channel over MAX_DAYS and only new days are downloaded on refresh.
+base_sql = f"""
 SELECT
-  SUM(s.view_count)    AS views,
-  SUM(s.like_count)    AS likes,
-  SUM(s.comment_count) AS comments
+  s.date          AS d,
+  v.video_id,
+  v.title,
+  c.channel_title,
+  v.published_at,
+  s.view_count    AS views,
+  s.like_count    AS likes,
+  s.comment_count AS comments
 FROM `{PROJECT}.{DATASET}.fact_video_statistics` s
 JOIN `{PROJECT}.{DATASET}.dim_videos`   v
   ON v.video_id = s.video_id
@@ -59,111 +69,50 @@ JOIN `{PROJECT}.{DATASET}.dim_channels` c
   ON c.channel_id = v.channel_id
 {where}
 """
-kpis = run_query(kpis_sql, params=params)
+# A full refresh scans MAX_DAYS of the join; under a tight byte cap narrow
+# the cached window instead of leaving the whole dashboard empty
+window = fit_window("overview", [(base_sql, params)], MAX_DAYS)
+if window is None:
+    st.stop()
+base = run_time_series([(base_sql, params)], "d", min(ndays, window), max_days=window)[0]
 
+# ---------------- KPIs ----------------
 st.markdown("### KPIs")
 c1, c2, c3 = st.columns(3)
-if not kpis.empty:
-    c1.metric("Total Views",    int(kpis.iloc[0]["views"] or 0))
-    c2.metric("Total Likes",    int(kpis.iloc[0]["likes"] or 0))
-    c3.metric("Total Comments", int(kpis.iloc[0]["comments"] or 0))
+if not base.empty:
+    totals = base[["views", "likes", "comments"]].sum()
+    c1.metric("Total Views",    int(totals["views"]))
+    c2.metric("Total Likes",    int(totals["likes"]))
+    c3.metric("Total Comments", int(totals["comments"]))
 else:
     st.info("No KPI data for this selection.")
 
 # ---------------- Daily time series ----------------
-daily_sql = f"""
-WITH daily AS (
-  SELECT s.date AS d,
-         SUM(s.view_count)    AS views,
-         SUM(s.like_count)    AS likes,
-         SUM(s.comment_count) AS comments
-  FROM `{PROJECT}.{DATASET}.fact_video_statistics` s
-  JOIN `{PROJECT}.{DATASET}.dim_videos`   v
-    ON v.video_id = s.video_id
-  JOIN `{PROJECT}.{DATASET}.dim_channels` c
-    ON c.channel_id = v.channel_id
-  {where}
-  GROUP BY 1
-)
-SELECT d, views, likes, comments
-FROM daily
-ORDER BY d
-"""
-daily = run_query(daily_sql, params=params)
-
 st.markdown("### Daily Metrics")
-if not daily.empty:
-    st.line_chart(daily.set_index("d")[["views", "likes", "comments"]])
+if not base.empty:
+    daily = base.groupby("d")[["views", "likes", "comments"]].sum().sort_index()
+    st.line_chart(daily)
 else:
     st.info("No time series data available in the selected window.")
 
 # ---------------- Recent top videos ----------------
-recent_sql = f"""
-SELECT
-  v.video_id,
-  v.title,
-  c.channel_title,
-  v.published_at,
-  s.view_count    AS views,
-  s.like_count    AS likes,
-  s.comment_count AS comments
-FROM `{PROJECT}.{DATASET}.fact_video_statistics` s
-JOIN `{PROJECT}.{DATASET}.dim_videos`   v
-  ON v.video_id = s.video_id
-JOIN `{PROJECT}.{DATASET}.dim_channels` c
-  ON c.channel_id = v.channel_id
-{where}
-ORDER BY s.view_count DESC
-LIMIT 50
-"""
-recent = run_query(recent_sql, params=params)
-
 st.markdown("### Recent Top Videos")
-if not recent.empty:
+if not base.empty:
     cols = ["published_at", "channel_title", "title", "views", "likes", "comments", "video_id"]
+    recent = base.nlargest(50, "views")
     st.dataframe(recent[cols])
 else:
     st.info("No videos found for this selection.")
 
 st.markdown("### Engagement Rate (likes + comments per 1000 views)")
-ratio_sql = f"""
-SELECT
-  AVG(SAFE_DIVIDE(like_count + comment_count, view_count) * 1000) AS engagement_per_1k_views
-FROM `{PROJECT}.{DATASET}.fact_video_statistics` s
-JOIN `{PROJECT}.{DATASET}.dim_videos` v ON v.video_id = s.video_id
-JOIN `{PROJECT}.{DATASET}.dim_channels` c ON c.channel_id = v.channel_id
-{where}
-"""
-ratio = run_query(ratio_sql, params=params)
-if not ratio.empty:
-    st.metric("Avg Engagement / 1 k Views", round(ratio.iloc[0][0], 2))
+if not base.empty:
+    # Same as AVG(SAFE_DIVIDE(...)): rows with zero views are left out
+    per_row = (base["likes"] + base["comments"]) / base["views"].where(base["views"] != 0)
+    ratio = per_row.mean() * 1000
+    if pd.notna(ratio):
+        st.metric("Avg Engagement / 1 k Views", round(ratio, 2))
 
 st.markdown("### Top Channels by Views")
-top_channels_sql = f"""
-SELECT c.channel_title, SUM(s.view_count) AS total_views
-FROM `{PROJECT}.{DATASET}.fact_video_statistics` s
-JOIN `{PROJECT}.{DATASET}.dim_videos` v ON v.video_id = s.video_id
-JOIN `{PROJECT}.{DATASET}.dim_channels` c ON c.channel_id = v.channel_id
-{where}
-GROUP BY 1
-ORDER BY total_views DESC
-LIMIT 10
-"""
-top_channels = run_query(top_channels_sql, params=params)
-if not top_channels.empty:
-    st.bar_chart(top_channels.set_index("channel_title")["total_views"])
-st.markdown("### Top Channels by Views")
-top_channels_sql = f"""
-SELECT c.channel_title, SUM(s.view_count) AS total_views
-FROM `{PROJECT}.{DATASET}.fact_video_statistics` s
-JOIN `{PROJECT}.{DATASET}.dim_videos` v ON v.video_id = s.video_id
-JOIN `{PROJECT}.{DATASET}.dim_channels` c ON c.channel_id = v.channel_id
-{where}
-GROUP BY 1
-ORDER BY total_views DESC
-LIMIT 10
-"""
-top_channels = run_query(top_channels_sql, params=params)
-if not top_channels.empty:
-    st.bar_chart(top_channels.set_index("channel_title")["total_views"])
-
+if not base.empty:
+    top_channels = base.groupby("channel_title")["views"].sum().nlargest(10).rename("total_views")
+    st.bar_chart(top_channels)
@@ -1,5 +1,5 @@
 import streamlit as st
-from utils.bq import run_query
+from utils.paging import paged_table, csv_export
 
 st.title("Trending Radar")
 
@@ -9,8 +9,9 @@ with st.sidebar:
     min_prob = st.slider("Min trending probability", 0.50, 0.99, 0.80, 0.01)
     model = st.text_input("Filter by model version (optional)")
 
-where = "WHERE p.y_prob >= CAST(@minp AS FLOAT64)"
-params = {"minp": str(min_prob)}
+# The keyset seek can't step past NULL sort keys, so they are excluded explicitly
+where = "WHERE p.y_prob IS NOT NULL AND p.video_id IS NOT NULL AND p.y_prob >= @minp"
+params = {"minp": float(min_prob)}
 if model:
     where += " AND p.model_version = @m"
     params["m"] = model
@@ -25,15 +26,13 @@ FROM `ml_artifacts.v_latest_predictions` p
 LEFT JOIN `youtube_staging.dim_videos` v ON v.video_id = p.video_id
 LEFT JOIN `youtube_staging.dim_channels` c ON c.channel_id = p.channel_id
 {where}
-ORDER BY p.y_prob DESC
-LIMIT 200
 """
-df = run_query(sql, params=params)
+# video_id breaks ties so every candidate lands on exactly one page
+order_by = [("y_prob", "DESC"), ("video_id", "ASC")]
 
 st.caption("Shows the most recent scoring run from ml_artifacts.predictions_daily")
+df = paged_table("trending", sql, params, order_by, page_size=50)
 if not df.empty:
-    st.dataframe(df)
-    st.download_button("Download CSV", df.to_csv(index=False).encode(), "trending_candidates.csv","text/csv")
+    csv_export("trending", f"{sql} ORDER BY p.y_prob DESC, p.video_id", params, "trending_candidates.csv")
 else:
     st.info("No candidates match the filters yet.")
-
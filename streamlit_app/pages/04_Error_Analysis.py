@@ -1,33 +1,48 @@
 import streamlit as st
 import pandas as pd
-from utils.bq import run_query
+from utils.bq import run_queries
 
 st.title("Error Analysis (Latest Snapshot)")
 
-sql = """
+# Buckets are counted in BigQuery; a missing y_pred counts as a negative
+# prediction and a missing y_true lands in TN
+buckets_sql = """
 SELECT
-  p.snapshot_date, p.model_version,
-  p.video_id, p.y_prob, p.y_pred, p.y_true,
-  v.title, c.channel_title, v.published_at
+  CASE
+    WHEN IFNULL(p.y_pred, FALSE) AND p.y_true THEN 'TP'
+    WHEN IFNULL(p.y_pred, FALSE) AND p.y_true = FALSE THEN 'FP'
+    WHEN NOT IFNULL(p.y_pred, FALSE) AND p.y_true THEN 'FN'
+    ELSE 'TN'
+  END AS bucket,
+  COUNT(*) AS n
+FROM `ml_artifacts.v_pred_vs_label` p
+GROUP BY bucket
+"""
+
+fns_sql = """
+SELECT
+  p.snapshot_date, c.channel_title, v.title,
+  p.y_prob, p.y_pred, p.y_true
 FROM `ml_artifacts.v_pred_vs_label` p
 LEFT JOIN `youtube_staging.dim_videos` v ON v.video_id = p.video_id
 LEFT JOIN `youtube_staging.dim_channels` c ON c.channel_id = v.channel_id
+WHERE NOT IFNULL(p.y_pred, FALSE) AND p.y_true
+ORDER BY p.y_prob DESC
+LIMIT 50
 """
-df = run_query(sql)
+buckets, fns = run_queries([buckets_sql, fns_sql])
 
-if df.empty:
+if buckets.empty:
     st.info("No predictions/labels available yet.")
     st.stop()
 
-df["bucket"] = df.apply(
-    lambda r: "TP" if (r.y_pred and r.y_true==True) else
-              "FP" if (r.y_pred and r.y_true==False) else
-              "FN" if ((not r.y_pred) and r.y_true==True) else "TN",
-    axis=1
-)
 st.subheader("Confusion Buckets")
-st.bar_chart(df["bucket"].value_counts())
+counts = buckets.set_index("bucket")["n"].reindex(["TP", "FP", "FN", "TN"], fill_value=0)
+st.bar_chart(counts)
 
 st.subheader("Biggest False Negatives (high probability but missed)")
-fns = df[(~df["y_pred"]) & (df["y_true"]==True)].sort_values("y_prob", ascending=False).head(50)
-st.dataframe(fns[["snapshot_date","channel_title","title","y_prob","y_pred","y_true"]])
+if fns.empty:
+    # No false negatives, or the query failed / was over the byte cap (already reported)
+    st.info("No false negatives to show.")
+else:
+    st.dataframe(fns[["snapshot_date","channel_title","title","y_prob","y_pred","y_true"]])
@@ -1,34 +1,34 @@
 import streamlit as st
-from utils.bq import run_query
+from utils.bq import run_time_series
+from utils.budget import fit_window
 
 st.title("Feature Insights (Gap-aware + Engagement)")
 
 PROJECT = st.secrets.get("gcp_project_id") or st.secrets["gcp_service_account"]["project_id"]
+MAX_DAYS = 90  # longest lookback offered; the cached series cover it
 
 with st.sidebar:
-    ndays = st.slider("Lookback window (days)", 7, 90, 30)
+    ndays = st.slider("Lookback window (days)", 7, MAX_DAYS, 30)
 
 # engagement features
 eng_sql = f"""
 SELECT snapshot_date,
        AVG(engagement_rate) AS avg_engagement
 FROM `{PROJECT}.ms_golden.video_engagement_features`
-WHERE snapshot_date >= DATE_SUB(CURRENT_DATE(), INTERVAL @d DAY)
+WHERE snapshot_date >= @since
 GROUP BY snapshot_date
 ORDER BY snapshot_date
 """
-eng = run_query(eng_sql, params={"d":str(ndays)})
 
 # comment activity features (volume proxy)
 cm_sql = f"""
 SELECT snapshot_date,
        AVG(comment_volume) AS avg_comment_volume
 FROM `{PROJECT}.ms_golden.video_comment_activity_features`
-WHERE snapshot_date >= DATE_SUB(CURRENT_DATE(), INTERVAL @d DAY)
+WHERE snapshot_date >= @since
 GROUP BY snapshot_date
 ORDER BY snapshot_date
 """
-cm = run_query(cm_sql, params={"d":str(ndays)})
 
 # gap-aware deltas from your ml features table
 ml_sql = f"""
@@ -37,11 +37,23 @@ SELECT snapshot_date,
        AVG(likes_delta_7d)     AS avg_likes_delta_7d,
        AVG(comments_delta_7d)  AS avg_comments_delta_7d
 FROM `{PROJECT}.ms_golden.video_features_for_ml`
-WHERE snapshot_date >= DATE_SUB(CURRENT_DATE(), INTERVAL @d DAY)
+WHERE snapshot_date >= @since
 GROUP BY snapshot_date
 ORDER BY snapshot_date
 """
-mlf = run_query(ml_sql, params={"d":str(ndays)})
+
+# A long lookback on the feature tables can exceed the page's byte cap
+queries = [(eng_sql, {}), (cm_sql, {}), (ml_sql, {})]
+window = fit_window("features", queries, ndays)
+if window is None:
+    st.stop()
+# A narrowed window must not fetch a full MAX_DAYS history either
+max_days = MAX_DAYS if window == ndays else window
+ndays = window
+
+# The three series are independent: submit together, wait once. Each keeps
+# its history over the longest window, so only new days are downloaded.
+eng, cm, mlf = run_time_series(queries, "snapshot_date", ndays, max_days=max_days)
 
 st.subheader("Engagement Rate (avg, daily)")
 if not eng.empty: st.line_chart(eng.set_index("snapshot_date")["avg_engagement"])
@@ -1,8 +1,12 @@
 import streamlit as st
-from utils.bq import run_query
+from utils.bq import run_time_series
 
 st.title("Model Monitoring (last 30 days)")
-df = run_query("SELECT * FROM `ml_artifacts.v_monitoring_30d`")
+# Only days newer than the cached history are downloaded
+df = run_time_series(
+    [("SELECT * FROM `ml_artifacts.v_monitoring_30d` WHERE snapshot_date >= @since", {})],
+    "snapshot_date", 30,
+)[0]
 if df.empty:
     st.info("No monitoring rows yet.")
     st.stop()
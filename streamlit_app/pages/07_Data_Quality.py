@@ -1,31 +1,96 @@
+import datetime
 import streamlit as st
-from utils.bq import run_query
+import pandas as pd
+from utils.bq import run_queries, table_metadata
 
 st.title("Data Quality & Freshness")
 
 PROJECT = st.secrets.get("gcp_project_id") or st.secrets["gcp_service_account"]["project_id"]
 
-fresh_sql = f"""
-SELECT 'fact_video_statistics' AS table_name,
-       MAX(date) AS latest,
-       COUNT(*) AS rows_today
-FROM `adrineto-qst882-fall25.youtube_staging.fact_video_statistics`
-WHERE date = (SELECT MAX(date) FROM `adrineto-qst882-fall25.youtube_staging.fact_video_statistics`)
-UNION ALL
-SELECT 'predictions_daily',
-       MAX(snapshot_date),
-       COUNTIF(snapshot_date = (SELECT MAX(snapshot_date) FROM `adrineto-qst882-fall25.ml_artifacts.predictions_daily`))
-FROM `adrineto-qst882-fall25.ml_artifacts.predictions_daily`
-UNION ALL
-SELECT 'labels_daily',
-       MAX(snapshot_date),
-       COUNTIF(snapshot_date = (SELECT MAX(snapshot_date) FROM `adrineto-qst882-fall25.ml_artifacts.labels_daily`))
-FROM `adrineto-qst882-fall25.ml_artifacts.labels_daily`
-UNION ALL
-SELECT 'monitoring_daily',
-       MAX(snapshot_date),
-       COUNTIF(snapshot_date = (SELECT MAX(snapshot_date) FROM `adrineto-qst882-fall25.ml_artifacts.monitoring_daily`))
-FROM `adrineto-qst882-fall25.ml_artifacts.monitoring_daily`;
+# dataset -> tables whose latest partition marks how fresh the data is
+TABLES = {
+    "youtube_staging": ["fact_video_statistics"],
+    "ml_artifacts": ["predictions_daily", "labels_daily", "monitoring_daily"],
+}
+
+with st.sidebar:
+    ndays = st.slider("Pipeline latency window (days)", 1, 30, 7)
+
+# Freshness comes from partition metadata, which scans no table data
+partitions_sql = """
+SELECT table_name, partition_id, total_rows, last_modified_time
+FROM `{project}.{dataset}.INFORMATION_SCHEMA.PARTITIONS`
+WHERE table_name IN UNNEST(@tables)
+  AND partition_id NOT IN ('__NULL__', '__UNPARTITIONED__')
+QUALIFY ROW_NUMBER() OVER (PARTITION BY table_name ORDER BY partition_id DESC) = 1
 """
-st.subheader("Latest partition dates")
-st.dataframe(run_query(fresh_sql))
+
+# Per run: time from the first span of the run to the end of each stage's
+# last span, i.e. when that stage's output was available. Async BigQuery jobs
+# are traced from the job's own end time once they finish (not at submission)
+latency_sql = f"""
+WITH spans AS (
+  SELECT run_id, stage, started_at,
+         TIMESTAMP_ADD(started_at, INTERVAL CAST(IFNULL(duration_ms, 0) AS INT64) MILLISECOND) AS ended_at
+  FROM `{PROJECT}.youtube_raw.pipeline_metrics`
+  WHERE logical_date >= @since
+),
+runs AS (
+  SELECT run_id, MIN(started_at) AS run_start FROM spans GROUP BY run_id
+)
+SELECT s.run_id, s.stage, r.run_start,
+       TIMESTAMP_DIFF(MAX(s.ended_at), r.run_start, MILLISECOND) / 1000 AS seconds_to_available
+FROM spans s JOIN runs r USING (run_id)
+GROUP BY s.run_id, s.stage, r.run_start
+"""
+
+since = datetime.date.today() - datetime.timedelta(days=ndays)
+results = run_queries(
+    [(partitions_sql.format(project=PROJECT, dataset=dataset), {"tables": tables}) for dataset, tables in TABLES.items()]
+    + [(latency_sql, {"since": since})],
+    cache=False,
+)
+partitions = pd.concat(
+    [df for df in results[:-1] if not df.empty]
+    or [pd.DataFrame(columns=["table_name", "partition_id", "total_rows", "last_modified_time"])]
+)
+latency = results[-1]
+
+meta = table_metadata(tuple(f"{PROJECT}.{dataset}.{table}" for dataset, tables in TABLES.items() for table in tables))
+if "error" not in meta.columns:
+    meta["error"] = None
+meta["table_name"] = meta["table_id"].str.split(".").str[-1]
+
+fresh = meta.merge(partitions, on="table_name", how="left")
+# DAY partitions are named YYYYMMDD (HOUR ones add HH)
+fresh["latest_partition"] = pd.to_datetime(fresh["partition_id"].astype("string").str[:8], format="%Y%m%d", errors="coerce").dt.date
+fresh["days_behind"] = (pd.Timestamp.today().normalize() - pd.to_datetime(fresh["latest_partition"])).dt.days
+
+st.subheader("Latest partitions")
+st.caption("From table and partition metadata; no table data is scanned")
+st.dataframe(fresh[[
+    "table_name", "latest_partition", "days_behind", "total_rows", "last_modified_time",
+    "num_rows", "modified", "partition_field", "error",
+]].rename(columns={
+    "total_rows": "rows_in_latest_partition",
+    "last_modified_time": "partition_modified",
+    "num_rows": "table_rows",
+    "modified": "table_modified",
+}))
+
+st.subheader(f"Pipeline latency (last {ndays} days)")
+if latency.empty:
+    st.info("No pipeline runs traced in this window.")
+    st.stop()
+st.caption("Seconds from run start until each stage's output was available")
+by_stage = latency.groupby("stage")["seconds_to_available"].agg(
+    runs="size",
+    p50="median",
+    p95=lambda s: s.quantile(0.95),
+    max="max",
+).sort_values("p50")
+st.dataframe(by_stage)
+
+st.subheader("Recent runs")
+recent = latency.pivot_table(index=["run_start", "run_id"], columns="stage", values="seconds_to_available")
+st.dataframe(recent.sort_index(ascending=False).head(20))
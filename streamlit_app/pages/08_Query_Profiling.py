@@ -0,0 +1,64 @@
+import streamlit as st
+import pandas as pd
+from utils.bq import load_query_log, QUERY_LOG_PATH
+
+st.title("Query Profiling")
+st.caption(f"Every run_query call on this server, from {QUERY_LOG_PATH}")
+
+log = load_query_log()
+if log.empty:
+    st.info("No queries logged yet.")
+    st.stop()
+
+for col in ["bytes_processed", "bytes_billed", "slot_ms", "rows"]:
+    if col not in log.columns:
+        log[col] = 0
+    log[col] = log[col].fillna(0)
+for col in ["local_cache_hit", "bq_cache_hit"]:
+    if col not in log.columns:
+        log[col] = False
+    log[col] = log[col].fillna(False).astype(bool)
+log["ts"] = pd.to_datetime(log["ts"], utc=True)
+
+with st.sidebar:
+    hours = st.slider("Last N hours", 1, 24 * 14, 24)
+    pages = st.multiselect("Pages", sorted(log["page"].dropna().unique()))
+
+log = log[log["ts"] >= pd.Timestamp.now(tz="UTC") - pd.Timedelta(hours=hours)]
+if pages:
+    log = log[log["page"].isin(pages)]
+if log.empty:
+    st.info("No queries in this window.")
+    st.stop()
+
+c1, c2, c3, c4 = st.columns(4)
+c1.metric("Calls", len(log))
+c2.metric("Local cache hit rate", f"{log['local_cache_hit'].mean():.0%}")
+c3.metric("GB billed", round(log["bytes_billed"].sum() / 1e9, 2))
+c4.metric("p95 latency (ms)", round(log["latency_ms"].quantile(0.95)))
+
+st.subheader("By page")
+by_page = log.groupby("page").agg(
+    calls=("latency_ms", "size"),
+    p50_ms=("latency_ms", "median"),
+    p95_ms=("latency_ms", lambda s: s.quantile(0.95)),
+    local_hit_rate=("local_cache_hit", "mean"),
+    bq_hit_rate=("bq_cache_hit", "mean"),
+    gb_billed=("bytes_billed", lambda s: s.sum() / 1e9),
+    slot_s=("slot_ms", lambda s: s.sum() / 1000),
+).sort_values("gb_billed", ascending=False)
+st.dataframe(by_page)
+
+st.subheader("Most expensive queries")
+by_query = log.groupby(["page", "query_id"]).agg(
+    sql=("sql", "first"),
+    calls=("latency_ms", "size"),
+    p95_ms=("latency_ms", lambda s: s.quantile(0.95)),
+    gb_billed=("bytes_billed", lambda s: s.sum() / 1e9),
+    slot_s=("slot_ms", lambda s: s.sum() / 1000),
+    avg_rows=("rows", "mean"),
+).sort_values(["gb_billed", "p95_ms"], ascending=False).head(20)
+st.dataframe(by_query)
+
+st.subheader("Recent calls")
+st.dataframe(log.sort_values("ts", ascending=False).head(200))
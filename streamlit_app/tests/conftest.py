@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Pages import the helpers as `utils.*` from the app directory (streamlit run app.py)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,50 @@
+"""Keyset predicate and next-page cursor used by query_page."""
+
+import pandas as pd
+from utils.keyset import keyset_predicate, split_page
+
+
+def test_desc_then_asc_tie_breaker():
+    where, params = keyset_predicate([("views", "DESC"), ("video_id", "ASC")], (100, "abc"))
+    assert where == "(views < @_after_0) OR (views = @_after_0 AND video_id > @_after_1)"
+    assert params == {"_after_0": 100, "_after_1": "abc"}
+
+
+def test_asc_key_compares_greater_than():
+    where, params = keyset_predicate([("video_id", "asc")], ("abc",))
+    assert where == "(video_id > @_after_0)"
+    assert params == {"_after_0": "abc"}
+
+
+def test_every_column_is_tied_before_the_next():
+    where, _ = keyset_predicate([("a", "DESC"), ("b", "DESC"), ("c", "ASC")], (1, 2, 3))
+    assert where == (
+        "(a < @_after_0) OR "
+        "(a = @_after_0 AND b < @_after_1) OR "
+        "(a = @_after_0 AND b = @_after_1 AND c > @_after_2)"
+    )
+
+
+def rows(n):
+    return pd.DataFrame({"views": [100 - i for i in range(n)], "video_id": [f"v{i}" for i in range(n)]})
+
+
+ORDER_BY = [("views", "DESC"), ("video_id", "ASC")]
+
+
+def test_extra_row_yields_cursor_of_last_shown_row():
+    page, cursor = split_page(rows(4), ORDER_BY, page_size=3)
+    assert len(page) == 3
+    assert cursor == (98, "v2")
+
+
+def test_exactly_page_size_rows_is_the_last_page():
+    page, cursor = split_page(rows(3), ORDER_BY, page_size=3)
+    assert len(page) == 3
+    assert cursor is None
+
+
+def test_empty_result_has_no_cursor():
+    page, cursor = split_page(rows(0), ORDER_BY, page_size=3)
+    assert page.empty
+    assert cursor is None
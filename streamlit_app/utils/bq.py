@@ -1,10 +1,65 @@
 import json
+import datetime
+import decimal
+import hashlib
+import inspect
+import os
+import re
+import tempfile
+import threading
+import time
 import collections.abc as cabc  # for Mapping / AttrDict check
-from typing import Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, Dict, Union
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
 from google.oauth2 import service_account
+from utils.keyset import keyset_predicate, split_page
+
+# Storage Read API for large results; without the package results page over REST
+try:
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
+
+# --- Persistent query cache ---
+# Results are stored as Parquet on local disk, shared by every session and
+# process and kept across restarts. An entry is reused until one of the tables
+# the query reads (views are followed to their base tables) is modified.
+CACHE_DIR = st.secrets.get("query_cache_dir") or os.path.join(tempfile.gettempdir(), "bq_query_cache")
+CACHE_MAX_BYTES = int(st.secrets.get("query_cache_max_mb", 512)) * 1024 * 1024
+# Seconds a table's last_modified time is trusted before asking BigQuery again
+TABLE_VERSION_TTL = 60
+# Per-call query profile, one JSON line per run_query call (see 08_Query_Profiling)
+QUERY_LOG_PATH = st.secrets.get("query_log_path") or os.path.join(CACHE_DIR, "query_log.jsonl")
+QUERY_LOG_MAX_BYTES = 50 * 1024 * 1024  # rotated to .1 beyond this
+_query_log_lock = threading.Lock()
+# Bytes a single query may bill, in MB: `max_bytes_billed_mb` in secrets is
+# either one number for every page or a table keyed by page file name
+# (e.g. "05_Feature_Insights.py") with an optional "default". Queries whose
+# dry-run estimate exceeds the cap are not run; 0 disables the cap.
+DEFAULT_MAX_BYTES_BILLED_MB = 5 * 1024
+# CSV exports (see export_csv); files older than this are swept on the next export
+EXPORT_DIR = os.path.join(CACHE_DIR, "exports")
+EXPORT_TTL_SECONDS = 60 * 60
+# Time-series histories (see run_time_series)
+SERIES_DIR = os.path.join(CACHE_DIR, "series")
+# When the tables change, days this far back are refetched (late data, MERGE
+# updates); the whole window is refetched at least every SERIES_FULL_REFRESH_HOURS
+# so backfills of older partitions reach the cache too
+SERIES_REFRESH_DAYS = 7
+SERIES_FULL_REFRESH_HOURS = 24
+# Tables after FROM/JOIN, with or without backticks (2 or 3 part names)
+TABLE_REF = re.compile(r"(?:FROM|JOIN)\s+`?([\w-]+(?:\.[\w-]+){1,2})`?", re.IGNORECASE)
+# Results that depend on the clock, not only on the tables: CURRENT_DATE
+# results are cached per (UTC) day, finer-grained ones not at all
+CURRENT_DATE_REF = re.compile(r"\bCURRENT_DATE\b", re.IGNORECASE)
+CLOCK_REF = re.compile(r"\b(?:CURRENT_TIMESTAMP|CURRENT_DATETIME|CURRENT_TIME|NOW)\b", re.IGNORECASE)
 
 # --- Optional debug expander (you can move this to app.py later) ---
 with st.expander("Debug secrets", expanded=False):
@@ -40,24 +95,562 @@ def get_bq_client() -> bigquery.Client:
     # Fallback: Application Default Credentials (env var or gcloud ADC)
     return bigquery.Client()
 
-@st.cache_data(ttl=600)
-def run_query(sql: str, params: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+@st.cache_resource(show_spinner=False)
+def get_bqstorage_client():
+    """
+    BigQuery Storage Read client sharing the BigQuery client's credentials,
+    or None when google-cloud-bigquery-storage is not installed.
+    """
+    if bigquery_storage is None:
+        return None
+    return bigquery_storage.BigQueryReadClient(credentials=get_bq_client()._credentials)
+
+def _to_python(value: Any) -> Any:
+    # numpy scalars (e.g. int64 from a DataFrame cell) match none of the
+    # types below and would bind as STRING; unwrap them
+    return value.item() if isinstance(value, np.generic) else value
+
+def _param_type(value: Any) -> str:
+    # bool before int: True is an int too
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, int):
+        return "INT64"
+    if isinstance(value, float):
+        return "FLOAT64"
+    if isinstance(value, decimal.Decimal):
+        return "NUMERIC"
+    if isinstance(value, (datetime.datetime, pd.Timestamp)):
+        return "TIMESTAMP"
+    if isinstance(value, datetime.date):
+        return "DATE"
+    return "STRING"
+
+def _query_parameters(params: Optional[Dict[str, Any]]) -> list:
+    """
+    Bind each param with the BigQuery type of its Python value (lists and
+    tuples become ARRAYs of their first element's type; numpy scalars are
+    unwrapped first). Prebuilt bigquery.*QueryParameter objects are passed
+    through.
+    """
+    query_parameters = []
+    for name, value in (params or {}).items():
+        if isinstance(value, (bigquery.ScalarQueryParameter, bigquery.ArrayQueryParameter)):
+            query_parameters.append(value)
+        elif isinstance(value, (list, tuple)):
+            values = [_to_python(v) for v in value]
+            element_type = _param_type(values[0]) if values else "STRING"
+            query_parameters.append(bigquery.ArrayQueryParameter(name, element_type, values))
+        else:
+            value = _to_python(value)
+            query_parameters.append(bigquery.ScalarQueryParameter(name, _param_type(value), value))
+    return query_parameters
+
+def _cache_key(sql: str, query_parameters: list, as_arrow: bool = False) -> str:
+    """
+    Hash of the whitespace-normalized SQL, the typed parameters and the
+    result format (pandas and Arrow results are stored separately).
+    """
+    spec = [
+        " ".join(sql.split()),
+        sorted((p.to_api_repr() for p in query_parameters), key=lambda p: p["name"]),
+        "arrow" if as_arrow else "pandas",
+    ]
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+def _referenced_tables(sql: str, default_project: str) -> set:
+    tables = set()
+    for ref in TABLE_REF.findall(sql):
+        parts = ref.split(".")
+        tables.add(".".join(parts if len(parts) == 3 else [default_project] + parts))
+    return tables
+
+@st.cache_data(ttl=TABLE_VERSION_TTL, show_spinner=False)
+def _table_versions(sql: str) -> Optional[str]:
+    """
+    Fingerprint of the last_modified time of every table the query reads,
+    following views down to their base tables, plus today's date when the
+    query or a view uses CURRENT_DATE. None if it can't be resolved or
+    depends on the current time, in which case the query is not cached on disk.
+    """
+    client = get_bq_client()
+    pending = list(_referenced_tables(sql, client.project))
+    if not pending:
+        return None
+    texts = [sql]
+    versions, seen = [], set()
+    while pending:
+        table_id = pending.pop()
+        if table_id in seen:
+            continue
+        seen.add(table_id)
+        try:
+            table = client.get_table(table_id)
+        except NotFound:
+            # e.g. `EXTRACT(... FROM t.col)`; a real missing table fails the query anyway
+            continue
+        except Exception:
+            return None
+        versions.append(f"{table_id}@{table.modified.isoformat()}")
+        view_sql = table.view_query or table.mview_query
+        if view_sql:
+            texts.append(view_sql)
+            pending.extend(_referenced_tables(view_sql, table.project))
+    if not versions or any(CLOCK_REF.search(t) for t in texts):
+        return None
+    if any(CURRENT_DATE_REF.search(t) for t in texts):
+        versions.append(f"today@{datetime.datetime.now(datetime.timezone.utc).date().isoformat()}")
+    return hashlib.sha256("|".join(sorted(versions)).encode()).hexdigest()[:16]
+
+def byte_cap(page: Optional[str] = None) -> Optional[int]:
+    """
+    Bytes a query from `page` (default: the calling page) may bill, or None
+    when uncapped.
+    """
+    setting = st.secrets.get("max_bytes_billed_mb", DEFAULT_MAX_BYTES_BILLED_MB)
+    if isinstance(setting, cabc.Mapping):
+        page = page or _calling_page()
+        setting = setting.get(page, setting.get("default", DEFAULT_MAX_BYTES_BILLED_MB))
+    mb = float(setting)
+    return int(mb * 1024 * 1024) if mb > 0 else None
+
+@st.cache_data(ttl=TABLE_VERSION_TTL, show_spinner=False)
+def _dry_run_bytes(sql: str, key: str, version: Optional[str], _query_parameters: list) -> int:
+    # `key` and `version` identify the query and table state (the parameter
+    # objects themselves are not hashed), so estimates are reused until a table changes
+    job_config = bigquery.QueryJobConfig(query_parameters=_query_parameters, dry_run=True, use_query_cache=False)
+    return get_bq_client().query(sql, job_config=job_config).total_bytes_processed or 0
+
+def estimate_bytes(sql: str, params: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Bytes `sql` would process, from a dry run (free, nothing is scanned).
+    """
+    query_parameters = _query_parameters(params)
+    return _dry_run_bytes(sql, _cache_key(sql, query_parameters), _table_versions(sql), query_parameters)
+
+@st.cache_data(ttl=TABLE_VERSION_TTL, show_spinner=False)
+def table_metadata(table_ids: tuple) -> pd.DataFrame:
     """
-    Run a query and return a DataFrame. Supports optional scalar string params.
+    Row count, size and last-modified time of each table from its metadata
+    (no query, no bytes scanned). Tables that can't be read get an error.
     """
+    client = get_bq_client()
+    rows = []
+    for table_id in table_ids:
+        try:
+            table = client.get_table(table_id)
+        except Exception as e:
+            rows.append({"table_id": table_id, "error": str(e)})
+            continue
+        rows.append({
+            "table_id": table_id,
+            "num_rows": table.num_rows,
+            "num_bytes": table.num_bytes,
+            "modified": table.modified,
+            "partition_field": table.time_partitioning.field if table.time_partitioning else None,
+        })
+    return pd.DataFrame(rows)
+
+def _read_cached(path: str, as_arrow: bool = False) -> Optional[Union[pd.DataFrame, pa.Table]]:
     try:
-        client = get_bq_client()
-        if params:
-            from google.cloud.bigquery import QueryJobConfig, ScalarQueryParameter
-            job_config = QueryJobConfig(
-                query_parameters=[
-                    ScalarQueryParameter(k, "STRING", v) for k, v in params.items()
-                ]
-            )
-            job = client.query(sql, job_config=job_config)
+        result = pq.read_table(path) if as_arrow else pd.read_parquet(path)
+    except Exception:
+        return None
+    try:
+        os.utime(path)  # mtime is the LRU clock
+    except OSError:
+        pass
+    return result
+
+def _atomic_write(path: str, write) -> None:
+    """
+    Call write(tmp) on a temp file unique to this writer, then move it over
+    `path`. Threads of one process never share a temp file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def _evict(keep: str) -> None:
+    """
+    Remove least recently used query results and series until the cache
+    fits CACHE_MAX_BYTES. A series counts with its .json metadata and is
+    removed together with it. `keep` (just written) is never removed.
+    """
+    entries = []
+    for folder in (CACHE_DIR, SERIES_DIR):
+        if not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            if not name.endswith(".parquet"):
+                continue
+            full = os.path.join(folder, name)
+            try:
+                stat = os.stat(full)
+                size = stat.st_size
+                if folder == SERIES_DIR and os.path.exists(f"{full}.json"):
+                    size += os.path.getsize(f"{full}.json")
+            except OSError:
+                continue  # removed by another writer meanwhile
+            entries.append((stat.st_mtime, size, full))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, full in sorted(entries):
+        if total <= CACHE_MAX_BYTES:
+            break
+        if full == keep:
+            continue
+        for victim in (full, f"{full}.json"):
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+        total -= size
+
+def _write_cached(path: str, result: Union[pd.DataFrame, pa.Table]) -> None:
+    """
+    Store a result atomically, drop older versions of the same query, then
+    evict least recently used entries until the cache fits CACHE_MAX_BYTES.
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        if isinstance(result, pa.Table):
+            _atomic_write(path, lambda tmp: pq.write_table(result, tmp))
         else:
-            job = client.query(sql)
-        return job.result().to_dataframe()
+            _atomic_write(path, lambda tmp: result.to_parquet(tmp, index=False))
+
+        key = os.path.basename(path).split("-")[0]
+        for name in os.listdir(CACHE_DIR):
+            full = os.path.join(CACHE_DIR, name)
+            if name.endswith(".parquet") and name.startswith(f"{key}-") and full != path:
+                os.remove(full)
+        _evict(keep=path)
     except Exception as e:
-        st.error(f"BigQuery query failed: {e}")
+        # The cache is an optimization; never fail the page over it
+        print(f"Query cache write failed: {e}")
+
+def _empty(as_arrow: bool) -> Union[pd.DataFrame, pa.Table]:
+    return pa.table({}) if as_arrow else pd.DataFrame()
+
+def _download(job, as_arrow: bool, bqstorage_client):
+    rows = job.result()
+    # Small results already fetched with the first page skip the Storage API
+    if as_arrow:
+        result = rows.to_arrow(bqstorage_client=bqstorage_client)
+    else:
+        result = rows.to_dataframe(bqstorage_client=bqstorage_client)
+    return result, time.perf_counter()
+
+def _calling_page() -> str:
+    """
+    File name of the page (or app.py) that called into this module.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    frame = inspect.currentframe()
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if os.path.dirname(os.path.abspath(filename)) != here:
+            return os.path.basename(filename)
+        frame = frame.f_back
+    return "unknown"
+
+def _log_query(entry: dict) -> None:
+    """
+    Append one profile record to the query log; never fails the page.
+    """
+    try:
+        os.makedirs(os.path.dirname(QUERY_LOG_PATH), exist_ok=True)
+        with _query_log_lock:
+            if os.path.exists(QUERY_LOG_PATH) and os.path.getsize(QUERY_LOG_PATH) > QUERY_LOG_MAX_BYTES:
+                os.replace(QUERY_LOG_PATH, f"{QUERY_LOG_PATH}.1")
+            with open(QUERY_LOG_PATH, "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+    except Exception as e:
+        print(f"Query log write failed: {e}")
+
+def load_query_log() -> pd.DataFrame:
+    """
+    The query profile log as a DataFrame (empty if nothing was logged yet).
+    """
+    if not os.path.exists(QUERY_LOG_PATH):
         return pd.DataFrame()
+    return pd.read_json(QUERY_LOG_PATH, lines=True)
+
+def _over_byte_cap(error: Exception) -> bool:
+    # BigQuery's reason when a job would bill more than maximum_bytes_billed
+    return any(err.get("reason") == "bytesBilledLimitExceeded" for err in getattr(error, "errors", None) or [])
+
+def run_queries(queries: list, as_arrow: bool = False, cache: bool = True) -> list:
+    """
+    Run a batch of queries concurrently; returns their results in order.
+    Each item is a SQL string or a (sql, params) tuple. Cache hits are served
+    from disk; every other query is submitted before any is waited on, so the
+    batch takes as long as its slowest query. A failed query shows an error
+    and yields an empty result. cache=False skips the on-disk query cache.
+    Queries run with the page's byte_cap as maximum_bytes_billed, so
+    BigQuery rejects one that would bill more before scanning anything; it
+    is then dry-run for the warning and yields an empty result. Queries that
+    fit never wait on a dry run.
+    """
+    results = [None] * len(queries)
+    pending = {}  # index -> (job, cache path, submit time, typed params)
+    page = _calling_page()
+    cap = byte_cap(page)
+
+    def profile(sql, latency_s, **fields):
+        normalized = " ".join(sql.split())
+        _log_query({
+            "ts": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "page": page,
+            "query_id": hashlib.sha256(normalized.encode()).hexdigest()[:12],
+            "sql": normalized[:300],
+            "latency_ms": round(latency_s * 1000, 1),
+            **fields,
+        })
+
+    try:
+        client = get_bq_client()
+        for i, item in enumerate(queries):
+            sql, params = (item, None) if isinstance(item, str) else item
+            started = time.perf_counter()
+            try:
+                query_parameters = _query_parameters(params)
+                path = None
+                version = _table_versions(sql) if cache else None
+                if version:
+                    path = os.path.join(CACHE_DIR, f"{_cache_key(sql, query_parameters, as_arrow)}-{version}.parquet")
+                    cached = _read_cached(path, as_arrow) if os.path.exists(path) else None
+                    if cached is not None:
+                        results[i] = cached
+                        profile(sql, time.perf_counter() - started, local_cache_hit=True,
+                                rows=cached.num_rows if as_arrow else len(cached))
+                        continue
+                job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+                if cap:
+                    job_config.maximum_bytes_billed = cap
+                pending[i] = (client.query(sql, job_config=job_config), path, started, query_parameters)
+            except Exception as e:
+                st.error(f"BigQuery query failed: {e}")
+                results[i] = _empty(as_arrow)
+                profile(sql, time.perf_counter() - started, error=str(e))
+
+        if pending:
+            bqstorage_client = get_bqstorage_client()
+            # Threads only wait on jobs and download; Streamlit calls stay on this thread
+            with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                futures = {i: pool.submit(_download, job, as_arrow, bqstorage_client) for i, (job, *_) in pending.items()}
+            for i, future in futures.items():
+                job, path, started, query_parameters = pending[i]
+                try:
+                    results[i], finished = future.result()
+                except Exception as e:
+                    results[i] = _empty(as_arrow)
+                    if cap and _over_byte_cap(e):
+                        # Rejected before scanning; the dry run only sizes the warning
+                        try:
+                            estimate = _dry_run_bytes(job.query, _cache_key(job.query, query_parameters),
+                                                      _table_versions(job.query), query_parameters)
+                            scan = f"it would scan {estimate / 1e9:.2f} GB"
+                        except Exception:
+                            estimate, scan = None, "it would scan more"
+                        st.warning(f"Query skipped: {scan}, over this page's {cap / 1e9:.2f} GB limit.")
+                        profile(job.query, time.perf_counter() - started, job_id=job.job_id, error="over byte cap",
+                                estimated_bytes=estimate, byte_cap=cap)
+                        continue
+                    st.error(f"BigQuery query failed: {e}")
+                    profile(job.query, time.perf_counter() - started, job_id=job.job_id, error=str(e))
+                    continue
+                profile(
+                    job.query, finished - started,
+                    job_id=job.job_id,
+                    local_cache_hit=False,
+                    bq_cache_hit=bool(job.cache_hit),
+                    bytes_processed=job.total_bytes_processed or 0,
+                    bytes_billed=job.total_bytes_billed or 0,
+                    slot_ms=job.slot_millis or 0,
+                    rows=results[i].num_rows if as_arrow else len(results[i]),
+                )
+                if path:
+                    _write_cached(path, results[i])
+    except Exception as e:
+        st.error(f"BigQuery query failed: {e}")
+        results = [r if r is not None else _empty(as_arrow) for r in results]
+    return results
+
+def run_query(sql: str, params: Optional[Dict[str, Any]] = None, as_arrow: bool = False) -> Union[pd.DataFrame, pa.Table]:
+    """
+    Run a query and return a DataFrame, or a pyarrow Table with as_arrow=True.
+    Param types follow the Python values (int -> INT64, float -> FLOAT64,
+    date -> DATE, list -> ARRAY, ...). Results larger than one page are
+    downloaded through the Storage Read API when it is installed.
+    Results come from the on-disk cache while the tables they read are unchanged.
+    """
+    return run_queries([(sql, params)], as_arrow=as_arrow)[0]
+
+def _as_dates(values: pd.Series) -> pd.Series:
+    return pd.to_datetime(values).dt.date
+
+def _read_series(path: str):
+    try:
+        with open(f"{path}.json") as f:
+            meta = json.load(f)
+        history = pd.read_parquet(path)
+    except Exception:
+        return None, None
+    try:
+        os.utime(path)  # same LRU clock as the query results
+    except OSError:
+        pass
+    return history, meta
+
+def _write_json(meta: dict, tmp: str) -> None:
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+
+def _write_series(path: str, history: pd.DataFrame, meta: dict) -> None:
+    """
+    Store a series and its metadata, then evict under the shared
+    CACHE_MAX_BYTES budget.
+    """
+    try:
+        os.makedirs(SERIES_DIR, exist_ok=True)
+        _atomic_write(path, lambda tmp: history.to_parquet(tmp, index=False))
+        _atomic_write(f"{path}.json", lambda tmp: _write_json(meta, tmp))
+        _evict(keep=path)
+    except Exception as e:
+        print(f"Series cache write failed: {e}")
+
+def run_time_series(queries: list, date_col: str, ndays: int, max_days: Optional[int] = None) -> list:
+    """
+    Daily series that only download what is new. Each item is a (sql, params)
+    tuple whose query selects `date_col` and filters `date_col >= @since`.
+
+    The history of each series is kept on disk covering `max_days` (so any
+    window up to that size is served locally). Nothing is fetched while the
+    tables it reads are unchanged. Once they change, the last
+    SERIES_REFRESH_DAYS days are refetched and merged, and the window is
+    trimmed; if the last full fetch is older than SERIES_FULL_REFRESH_HOURS
+    the whole window is refetched instead (at most once that often), so rewritten older partitions and
+    updated dimension rows are picked up. Returns the last `ndays` days of
+    each series, in order.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=ndays)
+    keep_from = today - datetime.timedelta(days=max(max_days or ndays, ndays))
+
+    results = [None] * len(queries)
+    to_fetch = []  # (index, sql, params, since, history to merge into, path, meta, fallback)
+    for i, (sql, params) in enumerate(queries):
+        params = params or {}
+        path = os.path.join(SERIES_DIR, f"{_cache_key(sql, _query_parameters(params))}.parquet")
+        history, meta = _read_series(path)
+        version = _table_versions(sql)
+        full_at = meta.get("full_at") if meta else None
+        stale = full_at is None or now - datetime.datetime.fromisoformat(full_at) > datetime.timedelta(hours=SERIES_FULL_REFRESH_HOURS)
+        covers = history is not None and datetime.date.fromisoformat(meta["covered_from"]) <= start
+        if covers and version and meta.get("version") == version:
+            results[i] = history
+            continue
+        if covers and not stale:
+            covered_from = datetime.date.fromisoformat(meta["covered_from"])
+            since = max(today - datetime.timedelta(days=SERIES_REFRESH_DAYS), covered_from)
+        else:
+            # Full fetch; the old history is only shown if the fetch fails
+            to_fetch.append((i, sql, params, keep_from, None, path,
+                             {"covered_from": keep_from.isoformat(), "full_at": now.isoformat(), "version": version}, history))
+            continue
+        to_fetch.append((i, sql, params, since, history, path, {**meta, "version": version}, history))
+
+    fetched = run_queries([(sql, {**params, "since": since}) for _, sql, params, since, *_ in to_fetch], cache=False)
+    for (i, _, _, since, history, path, meta, fallback), new in zip(to_fetch, fetched):
+        if new.columns.empty:
+            # Query failed (already reported); show what we have
+            results[i] = fallback if fallback is not None else new
+            continue
+        if history is not None and not history.empty:
+            new = pd.concat([history[_as_dates(history[date_col]) < since], new], ignore_index=True)
+        covered_from = max(datetime.date.fromisoformat(meta["covered_from"]), keep_from)
+        if not new.empty:
+            new = new[_as_dates(new[date_col]) >= covered_from]
+        meta["covered_from"] = covered_from.isoformat()
+        _write_series(path, new, meta)
+        results[i] = new
+
+    out = []
+    for df in results:
+        if not df.empty and date_col in df.columns:
+            df = df[_as_dates(df[date_col]) >= start].sort_values(date_col).reset_index(drop=True)
+        out.append(df)
+    return out
+
+def query_page(sql: str, params: Optional[Dict[str, Any]], order_by: list, page_size: int, after: Optional[tuple] = None):
+    """
+    One page of `sql` (without its own ORDER BY / LIMIT), using keyset
+    pagination: `order_by` is a list of (column, "ASC"|"DESC") ending in a
+    unique, non-null key, and `after` is the cursor returned for the previous
+    page. Returns the page and the cursor of the next one (None on the last).
+    """
+    where, after_params = keyset_predicate(order_by, after) if after else ("TRUE", {})
+    order = ", ".join(f"{col} {direction}" for col, direction in order_by)
+    # One extra row tells whether another page exists
+    page_sql = f"SELECT * FROM ({sql}) WHERE {where} ORDER BY {order} LIMIT {int(page_size) + 1}"
+    df = run_query(page_sql, params={**(params or {}), **after_params})
+    return split_page(df, order_by, page_size)
+
+def _sweep_exports() -> None:
+    # Sessions that end (or re-export) leave their files behind; drop old ones
+    cutoff = time.time() - EXPORT_TTL_SECONDS
+    try:
+        for name in os.listdir(EXPORT_DIR):
+            full = os.path.join(EXPORT_DIR, name)
+            if os.path.getmtime(full) < cutoff:
+                os.remove(full)
+    except OSError as e:
+        print(f"Export sweep failed: {e}")
+
+def export_csv(sql: str, params: Optional[Dict[str, Any]] = None, page_size: int = 10000) -> str:
+    """
+    Write the full result of `sql` to a CSV file in EXPORT_DIR one page at a
+    time, so only a page is held in memory. Returns the file path; the file
+    is removed by a later export once older than EXPORT_TTL_SECONDS.
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _sweep_exports()
+    client = get_bq_client()
+    started = time.perf_counter()
+    job_config = bigquery.QueryJobConfig(query_parameters=_query_parameters(params))
+    job_config.maximum_bytes_billed = byte_cap()
+    job = client.query(sql, job_config=job_config)
+    rows = job.result(page_size=page_size)
+    fd, path = tempfile.mkstemp(suffix=".csv", dir=EXPORT_DIR)
+    n = 0
+    with os.fdopen(fd, "w", newline="") as f:
+        for i, df in enumerate(rows.to_dataframe_iterable(bqstorage_client=get_bqstorage_client())):
+            df.to_csv(f, index=False, header=(i == 0))
+            n += len(df)
+    normalized = " ".join(sql.split())
+    _log_query({
+        "ts": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "page": _calling_page(),
+        "query_id": hashlib.sha256(normalized.encode()).hexdigest()[:12],
+        "sql": normalized[:300],
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        "job_id": job.job_id,
+        "local_cache_hit": False,
+        "bq_cache_hit": bool(job.cache_hit),
+        "bytes_processed": job.total_bytes_processed or 0,
+        "bytes_billed": job.total_bytes_billed or 0,
+        "slot_ms": job.slot_millis or 0,
+        "rows": n,
+        "export": True,
+    })
+    return path
@@ -0,0 +1,30 @@
+import datetime
+from typing import Optional
+import streamlit as st
+from utils.bq import byte_cap, estimate_bytes
+
+def fit_window(key: str, queries: list, ndays: int, date_param: str = "since") -> Optional[int]:
+    """
+    Largest lookback (up to `ndays`) whose queries each stay under the page's
+    byte cap. `queries` are (sql, params) tuples filtering on @<date_param>;
+    they are dry-run over the full window. When one would exceed the cap the
+    estimate is shown and the user can narrow the window (assuming the scan
+    shrinks with the date range, i.e. the tables are date-partitioned) or skip
+    the queries. Returns the window to use, or None to skip.
+    """
+    cap = byte_cap()
+    if cap is None:
+        return ndays
+    since = datetime.date.today() - datetime.timedelta(days=ndays)
+    worst = max(estimate_bytes(sql, {**(params or {}), date_param: since}) for sql, params in queries)
+    if worst <= cap:
+        return ndays
+
+    fitting = int(ndays * cap / worst)
+    st.warning(
+        f"A {ndays}-day window would scan {worst / 1e9:.2f} GB per query, "
+        f"over this page's {cap / 1e9:.2f} GB limit."
+    )
+    options = ([f"Narrow to the last {fitting} days"] if fitting >= 1 else []) + ["Skip these charts"]
+    choice = st.radio("Fallback", options, key=f"{key}_fallback")
+    return fitting if choice.startswith("Narrow") else None
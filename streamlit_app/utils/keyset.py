@@ -0,0 +1,28 @@
+"""
+Keyset pagination helpers for query_page (no BigQuery access here).
+"""
+from typing import Optional, Tuple
+import pandas as pd
+
+def keyset_predicate(order_by: list, after: tuple) -> Tuple[str, dict]:
+    """
+    Predicate selecting rows after `after` in `order_by` order, e.g. for
+    [(a, DESC), (b, ASC)]: (a < @_after_0) OR (a = @_after_0 AND b > @_after_1).
+    """
+    clauses, params = [], {}
+    for i, (col, direction) in enumerate(order_by):
+        op = "<" if direction.upper() == "DESC" else ">"
+        ties = [f"{c} = @_after_{j}" for j, (c, _) in enumerate(order_by[:i])]
+        clauses.append("(" + " AND ".join(ties + [f"{col} {op} @_after_{i}"]) + ")")
+        params[f"_after_{i}"] = after[i]
+    return " OR ".join(clauses), params
+
+def split_page(df: pd.DataFrame, order_by: list, page_size: int) -> Tuple[pd.DataFrame, Optional[tuple]]:
+    """
+    Split a result fetched with LIMIT page_size + 1 into the page and the
+    cursor of the next one (its last row's key), or None on the last page.
+    """
+    has_more = len(df) > page_size
+    df = df.head(page_size)
+    cursor = tuple(df.iloc[-1][col] for col, _ in order_by) if has_more else None
+    return df, cursor
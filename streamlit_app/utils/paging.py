@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+from typing import Any, Optional, Dict
+import streamlit as st
+import pandas as pd
+from utils.bq import query_page, export_csv
+
+def _signature(sql: str, params: Optional[Dict[str, Any]]) -> str:
+    return hashlib.sha256(json.dumps([sql, params or {}], sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def paged_table(key: str, sql: str, params: Optional[Dict[str, Any]], order_by: list, page_size: int = 50) -> pd.DataFrame:
+    """
+    Browse the result of `sql` one page at a time with Previous / Next
+    buttons (see query_page). Only the visible page is downloaded; the page
+    cursors live in session state and reset when the query or params change.
+    """
+    state_key = f"paged_{key}"
+    signature = _signature(sql, params)
+    state = st.session_state.get(state_key)
+    if not state or state["signature"] != signature:
+        state = {"signature": signature, "cursors": [None]}
+        st.session_state[state_key] = state
+
+    page = len(state["cursors"]) - 1
+    df, next_cursor = query_page(sql, params, order_by, page_size, state["cursors"][-1])
+    st.dataframe(df)
+
+    prev_col, info_col, next_col = st.columns([1, 4, 1])
+    if prev_col.button("Previous", key=f"{key}_prev", disabled=page == 0):
+        state["cursors"].pop()
+        st.rerun()
+    if not df.empty:
+        info_col.caption(f"Page {page + 1} (rows {page * page_size + 1}-{page * page_size + len(df)})")
+    if next_col.button("Next", key=f"{key}_next", disabled=next_cursor is None):
+        state["cursors"].append(next_cursor)
+        st.rerun()
+    return df
+
+def csv_export(key: str, sql: str, params: Optional[Dict[str, Any]], file_name: str) -> None:
+    """
+    Two-step CSV download of the full result: the file is written page by
+    page (see export_csv) only when requested, then offered for download.
+    A session's previous file is removed when it is replaced; files of
+    sessions that ended are swept by export_csv.
+    """
+    state_key = f"export_{key}"
+    signature = _signature(sql, params)
+    export = st.session_state.get(state_key)
+    if export and export["signature"] != signature:
+        # Filters changed: the prepared file is stale
+        if os.path.exists(export["path"]):
+            os.remove(export["path"])
+        export = st.session_state[state_key] = None
+
+    if st.button("Prepare CSV export", key=f"{key}_export"):
+        if export and os.path.exists(export["path"]):
+            os.remove(export["path"])
+            export = st.session_state[state_key] = None
+        with st.spinner("Exporting..."):
+            try:
+                export = st.session_state[state_key] = {"signature": signature, "path": export_csv(sql, params)}
+            except Exception as e:
+                # e.g. the export would bill more than the page's byte cap
+                st.error(f"Export failed: {e}")
+
+    if export and os.path.exists(export["path"]):
+        with open(export["path"], "rb") as f:
+            st.download_button("Download CSV", f, file_name, "text/csv", key=f"{key}_download")